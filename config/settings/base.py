@@ -307,6 +307,17 @@ CELERY_TASK_TIME_LIMIT = 5 * 60
 CELERY_TASK_SOFT_TIME_LIMIT = 60
 # https://docs.celeryq.dev/en/stable/userguide/configuration.html#beat-scheduler
 CELERY_BEAT_SCHEDULER = "django_celery_beat.schedulers:DatabaseScheduler"
+# https://docs.celeryq.dev/en/stable/userguide/periodic-tasks.html#beat-entries
+CELERY_BEAT_SCHEDULE = {
+    "drive-collect-orphans": {
+        "task": "dorchive.drive.tasks.collect_orphans",
+        "schedule": 60 * 60 * 24,
+    },
+    "drive-reconcile-usage": {
+        "task": "dorchive.drive.tasks.reconcile_usage",
+        "schedule": 60 * 60 * 24,
+    },
+}
 # https://docs.celeryq.dev/en/stable/userguide/configuration.html#worker-send-task-events
 CELERY_WORKER_SEND_TASK_EVENTS = True
 # https://docs.celeryq.dev/en/stable/userguide/configuration.html#std-setting-task_send_sent_event
@@ -336,6 +347,13 @@ SOCIALACCOUNT_FORMS = {"signup": "dorchive.users.forms.UserSocialSignupForm"}
 # Your stuff...
 # ------------------------------------------------------------------------------
 
+# Drive
+# ------------------------------------------------------------------------------
+# Seconds a user's effective permissions on a file stay in the shared cache
+DRIVE_PERMISSION_CACHE_TIMEOUT = 60 * 5
+# Hours a stored blob without a file is kept before it counts as an orphan
+DRIVE_ORPHAN_GRACE_HOURS = 24
+
 # Django-Jazzmin Theme Settings
 JAZZMIN_SETTINGS = {
     "site_title": "Workdrive",
@@ -1,6 +1,8 @@
 from django.contrib import admin
 
 from .models import (
+    Blob,
+    BlobReclaim,
     File, 
     GroupFile, 
     UserFile, 
@@ -31,10 +33,20 @@ class UserGroupAdmin(admin.ModelAdmin):
     list_display = ["user", "group", "is_admin"]
     list_display_links = ["user", "group"]
 
+class BlobAdmin(admin.ModelAdmin):
+    list_display = ["name", "size", "ref_count", "created"]
+    search_fields = ["digest", "name",]
+
+class BlobReclaimAdmin(admin.ModelAdmin):
+    list_display = ["name", "attempts", "created"]
+    search_fields = ["name",]
+
 admin.site.register(Group, GroupAdmin)
 admin.site.register(File, FileAdmin)
 admin.site.register(GroupFile, GroupFileAdmin)
 admin.site.register(UserFile, UserFileAdmin)
 admin.site.register(UserGroup, UserGroupAdmin)
+admin.site.register(Blob, BlobAdmin)
+admin.site.register(BlobReclaim, BlobReclaimAdmin)
 
 
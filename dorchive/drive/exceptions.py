@@ -2,3 +2,9 @@ class DuplicateFileError(Exception):
     pass
 
 
+class InvalidMoveError(Exception):
+    pass
+
+
+class QuotaExceededError(Exception):
+    pass
@@ -6,6 +6,30 @@ from .models import Document, File, Folder
 class MultipleFileInput(forms.ClearableFileInput):
     allow_multiple_selected = True
 
+class SearchSelectMultiple(forms.SelectMultiple):
+    """
+    Multiple select that renders only the chosen options; the others are
+    fetched from data-search-url as the user types
+    """
+
+    def optgroups(self, name, value, attrs=None):
+        selected = [v for v in value if v]
+        groups = []
+        if not selected:
+            return groups
+        choices = self.choices
+        for index, obj in enumerate(choices.queryset.filter(pk__in=selected)):
+            option = self.create_option(
+                name,
+                choices.field.prepare_value(obj),
+                choices.field.label_from_instance(obj),
+                True,
+                index,
+                attrs=attrs,
+            )
+            groups.append((None, [option], index))
+        return groups
+
 class UserMultipleChoiceField(forms.ModelMultipleChoiceField):
 
     def label_from_instance(self, obj):
@@ -73,7 +97,7 @@ class FileOrganizeForm(forms.ModelForm):
 class ShareWithGroupForm(forms.Form):
     groups = GroupMultipleChoiceField(
         queryset=None,
-        widget=forms.SelectMultiple(
+        widget=SearchSelectMultiple(
             attrs={
                 "class": "form-control",
                 "data-placeholder": "Choose groups... "
@@ -89,13 +113,16 @@ class ShareWithGroupForm(forms.Form):
 
     def __init__(self, *args, **kwargs):
         groups = kwargs.pop("groups")
+        search_url = kwargs.pop("search_url", None)
         super().__init__(*args, **kwargs)
         self.fields["groups"].queryset = groups
+        if search_url:
+            self.fields["groups"].widget.attrs["data-search-url"] = search_url
 
 class ShareWithPeopleForm(forms.Form):
     people = UserMultipleChoiceField(
         queryset=None,
-        widget=forms.SelectMultiple(
+        widget=SearchSelectMultiple(
             attrs={
                 "class": "form-control",
                 "data-placeholder": "Choose people... "
@@ -111,13 +138,16 @@ class ShareWithPeopleForm(forms.Form):
 
     def __init__(self, *args, **kwargs):
         people = kwargs.pop("people")
+        search_url = kwargs.pop("search_url", None)
         super().__init__(*args, **kwargs)
         self.fields["people"].queryset = people
+        if search_url:
+            self.fields["people"].widget.attrs["data-search-url"] = search_url
 
 class GroupMemberForm(forms.Form):
     members = GroupMultipleChoiceField(
         queryset=None,
-        widget=forms.SelectMultiple(
+        widget=SearchSelectMultiple(
             attrs={
                 "class": "form-control",
                 "data-placeholder": "Choose members... "
@@ -130,5 +160,8 @@ class GroupMemberForm(forms.Form):
 
     def __init__(self, *args, **kwargs):
         members = kwargs.pop("members")
+        search_url = kwargs.pop("search_url", None)
         super().__init__(*args, **kwargs)
-        self.fields["members"].queryset = members
\ No newline at end of file
+        self.fields["members"].queryset = members
+        if search_url:
+            self.fields["members"].widget.attrs["data-search-url"] = search_url
\ No newline at end of file
@@ -39,8 +39,14 @@ class DriveHookset:
     def file_shared_message(self, request, file):
         messages.success(request, _(f"{file} is now shared"))
 
-    def file_unshared_message(self, request, file):
-        messages.success(request, _(f"{file} is now unshared"))
+    def file_unshared_message(self, request, file, revoked=None):
+        if revoked is None:
+            messages.success(request, _(f"{file} is now unshared"))
+        else:
+            messages.success(request, _(f"{file} is now unshared ({revoked} grants revoked)"))
+
+    def trash_emptying_message(self, request):
+        messages.info(request, _("Your trash is being emptied in the background"))
 
     def member_added_message(self, request, group):
         messages.success(request, _(f"New member added"))
@@ -48,16 +54,17 @@ class DriveHookset:
     def file_exists_message(self, name, file):
         return f"{name} already exists in {file}"
     
-    def folder_pre_delete(self, request, folder):
-        for member in folder.get_children():
-            if member.__class__ == folder.__class__:
-                self.folder_pre_delete(request, member)
-            member.delete()
-   
     def file_upload_to(self, instance, filename):
         ext = filename.split(".")[-1]
         filename = f"{uuid.uuid4()}.{ext}"
         return os.path.join(UPLOAD_DIR, filename)
 
+    def blob_upload_to(self, digest):
+        """
+        Content addressed name of a blob, fanned out over two directory levels
+        so no single directory grows unbounded
+        """
+        return os.path.join(UPLOAD_DIR, digest[:2], digest[2:4], digest)
+
 
 hookset = DriveHookset()
\ No newline at end of file
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+from dorchive.drive.models import File
+
+
+class Command(BaseCommand):
+    help = "Store the blob size of files uploaded before sizes were persisted"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **kwargs):
+        batch_size = kwargs["batch_size"]
+        files = (
+            File.all_objects.filter(size_bytes__isnull=True)
+            .exclude(file="")
+            .exclude(file__isnull=True)
+            .only("pk", "file")
+        )
+
+        batch = []
+        updated = missing = 0
+        for file in files.iterator(chunk_size=batch_size):
+            try:
+                file.size_bytes = file.file.size
+            except OSError:
+                missing += 1
+                self.stdout.write(self.style.WARNING(f"Blob missing for {file.pk}: {file.file.name}"))
+                continue
+            batch.append(file)
+            if len(batch) >= batch_size:
+                updated += File.all_objects.bulk_update(batch, ["size_bytes"])
+                batch = []
+        if batch:
+            updated += File.all_objects.bulk_update(batch, ["size_bytes"])
+
+        self.stdout.write(self.style.SUCCESS(f"Sizes stored for {updated} files, {missing} blobs missing"))
@@ -0,0 +1,36 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from dorchive.drive.orphans import OrphanCollector
+
+
+class Command(BaseCommand):
+    help = "Report, and optionally delete, stored blobs that no file references"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=2000)
+        parser.add_argument("--grace-hours", type=int, help="Defaults to DRIVE_ORPHAN_GRACE_HOURS")
+        parser.add_argument("--delete", action="store_true", help="Delete the orphans found")
+
+    def handle(self, *args, **kwargs):
+        grace = None
+        if kwargs["grace_hours"] is not None:
+            grace = timedelta(hours=kwargs["grace_hours"])
+        collector = OrphanCollector(
+            grace=grace,
+            batch_size=kwargs["batch_size"],
+            delete=kwargs["delete"],
+        )
+
+        def report(name, deleted):
+            if deleted:
+                self.stdout.write(f"Deleted orphan {name}")
+            elif kwargs["delete"]:
+                self.stdout.write(self.style.WARNING(f"Could not delete orphan {name}"))
+            else:
+                self.stdout.write(f"Orphan {name}")
+
+        scan = collector.collect(callback=report)
+        self.stdout.write(self.style.SUCCESS(
+            f"Scanned {scan.scanned} blobs, {scan.found} orphans found, {scan.deleted} deleted"
+        ))
@@ -0,0 +1,68 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from dorchive.drive.hooks import hookset
+from dorchive.drive.models import Blob, BlobReclaim, File
+from dorchive.drive.tasks import schedule_reclaim
+
+
+def hash_blob(name):
+    try:
+        with default_storage.open(name) as content:
+            return name, Blob.objects.hash(content), None
+    except OSError as error:
+        return name, None, error
+
+
+class Command(BaseCommand):
+    help = "Move blobs stored before deduplication under their content digest, sharing identical content"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument("--workers", type=int, default=8, help="Blobs hashed in parallel")
+
+    def handle(self, *args, **kwargs):
+        batch_size = kwargs["batch_size"]
+        legacy = (
+            File.all_objects.exclude(file="")
+            .exclude(file__isnull=True)
+            .exclude(file__in=Blob.objects.values("name"))
+            .order_by("file")
+            .values_list("file", flat=True)
+            .distinct()
+        )
+
+        rehashed = duplicates = missing = freed = 0
+        last = None
+        with ThreadPoolExecutor(max_workers=kwargs["workers"]) as executor:
+            while True:
+                names = legacy if last is None else legacy.filter(file__gt=last)
+                names = list(names[:batch_size])
+                if not names:
+                    break
+                last = names[-1]
+
+                for name, hashed, error in executor.map(hash_blob, names):
+                    if error is not None:
+                        missing += 1
+                        self.stdout.write(self.style.WARNING(f"Blob missing: {name}"))
+                        continue
+                    digest, size = hashed
+                    with transaction.atomic():
+                        files = File.all_objects.filter(file=name)
+                        references = files.update(file=hookset.blob_upload_to(digest))
+                        duplicate = Blob.objects.filter(digest=digest).exists()
+                        with default_storage.open(name) as content:
+                            Blob.objects.store(content, digest, size, references=references)
+                        BlobReclaim.objects.create(name=name)
+                        schedule_reclaim()
+                    rehashed += 1
+                    if duplicate:
+                        duplicates += 1
+                        freed += size
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Rehashed {rehashed} blobs, {duplicates} duplicates freeing {freed} bytes, {missing} blobs missing"
+        ))
@@ -1,41 +1,35 @@
-import itertools
-import operator
-from django.apps import apps
-from django.db.models import Q
-from django.db.models.query import QuerySet
-from model_utils.managers import SoftDeletableManager
-
+import hashlib
+import os
+from collections import Counter, defaultdict
 
-class GroupFileQuerySet(QuerySet):
-
-    def __init__(self, **kwargs):
-        if "group" in kwargs:
-            self.group = kwargs.pop("group")
-        super().__init__(**kwargs)
+from django.apps import apps
+from django.core.files.storage import default_storage
+from django.db import models
+from django.db.models import Exists, F, OuterRef, Q, Sum, TextField, Value
+from django.db.models.functions import Concat, Substr
+from django.utils import timezone
+from model_utils.managers import SoftDeletableManager, SoftDeletableQuerySet
 
-    def iterator(self):
-        shared_model = self.model.group_file_model()
-        shared_files = shared_model.for_group(self.group)
-        for object in super().iterator():
-            if object.pk in shared_files:
-                object.shared = True
-            yield object
+from .hooks import hookset
+from .pagination import KeysetPaginator
+from .registry import FileKind
 
+PATH_SEPARATOR = "/"
 
-class UserFileQuerySet(QuerySet):
 
-    def __init__(self, **kwargs):
-        if "user" in kwargs:
-            self.user = kwargs.pop("user")
-        super().__init__(**kwargs)
+class FileQuerySet(SoftDeletableQuerySet):
 
-    def iterator(self):
-        shared_model = self.model.user_file_model()
-        shared_files = shared_model.for_user(self.user)
-        for object in super().iterator():
-            if object.pk in shared_files:
-                object.shared = True
-            yield object
+    def with_shared_flag(self, group=None, user=None):
+        """
+        Annotate each file with whether it has been shared with group or user
+        """
+        if group is not None:
+            shared_model = self.model.group_file_model()
+            grants = shared_model.objects.filter(file=OuterRef("pk"), group=group)
+        else:
+            shared_model = self.model.user_file_model()
+            grants = shared_model.objects.filter(file=OuterRef("pk"), user=user)
+        return self.annotate(shared=Exists(grants))
 
 
 class GroupManager(SoftDeletableManager):
@@ -63,7 +57,7 @@ class GroupManager(SoftDeletableManager):
 
     def folders(self, group):
         File = apps.get_model("drive", "File")
-        return File.objects.filter(group=group).filter(file_type__name="Folder")
+        return File.objects.filter(group=group, kind=FileKind.FOLDER)
 
     def for_user(self, user):
         try:
@@ -77,33 +71,7 @@ class GroupManager(SoftDeletableManager):
 
 
 class FileManager(SoftDeletableManager):
-
-    def _group_file_queryset(self, group):
-        qs = GroupFileQuerySet(model=self.model, using=self._db, group=group)
-        return qs.exclude(is_removed=True)
-    
-    def _user_file_queryset(self, user):
-        qs = UserFileQuerySet(model=self.model, using=self._db, user=user)
-        return qs.exclude(is_removed=True)
-
-    def _shared_with_group(self, group):
-        qs = self._group_file_queryset(group)
-        qs = qs.filter(groupfile__group=group).exclude(parent__isnull=False)
-        return qs.distinct() & self.distinct()
-
-    def _shared_with_user(self, user):
-        qs = self._user_file_queryset(user)
-        qs = qs.filter(userfile__user=user).exclude(parent__isnull=False)
-        return qs.distinct() & self.distinct()
-
-    def _user_groups_files(self, user):
-        group_files = []
-        groups = user.usergroups.all()
-        if len(groups) > 0:
-            for group in groups:
-                files = self._shared_with_group(group)
-                group_files.extend(files)
-        return group_files
+    _queryset_class = FileQuerySet
 
     def get_all_queryset(self):
         qs = self._queryset_class(model=self.model, using=self._db)
@@ -116,23 +84,78 @@ class FileManager(SoftDeletableManager):
     
     def children(self, file, **kwargs):
         direct = kwargs.get("direct", True)
-        files = self.for_folder(folder=file)
-        manager = sorted(files, key=operator.attrgetter("name"))
         if direct:
-            return manager
-        for child in files:
-            manager.extend(self.children(child, **kwargs))
-        return manager
+            return KeysetPaginator.order(self.for_folder(folder=file))
+        return list(self.descendants(file).order_by("path"))
+
+    def descendants(self, file):
+        """
+        Retrieve the whole subtree below file in a single query
+        """
+        return self.filter(path__startswith=file.path).exclude(pk=file.pk)
+
+    def ancestors(self, file):
+        """
+        Retrieve the ancestors of file, root first, in a single query
+        """
+        ids = file.get_ancestor_ids()
+        if not ids:
+            return self.get_all_queryset().none()
+        qs = self.get_all_queryset().filter(pk__in=ids)
+        return qs.select_related("group", "file_type").order_by("depth")
+
+    def is_descendant(self, file, ancestor):
+        return self.descendants(ancestor).filter(pk=file.pk).exists()
+
+    def rollup(self, path, bytes, files):
+        """
+        Add bytes and files to the totals of every ancestor in path, up to and
+        including the nearest trashed one
+        """
+        ids = path.split(PATH_SEPARATOR)[:-2]
+        if not ids or (bytes == 0 and files == 0):
+            return 0
+        ancestors = self.get_all_queryset().filter(pk__in=ids).order_by("-depth")
+        affected = []
+        for pk, is_removed in ancestors.values_list("pk", "is_removed"):
+            affected.append(pk)
+            if is_removed:
+                break
+        return self.get_all_queryset().filter(pk__in=affected).update(
+            total_bytes=F("total_bytes") + bytes,
+            total_files=F("total_files") + files,
+        )
+
+    def count_child(self, path, delta):
+        """
+        Adjust the live child count of the parent at the end of path
+        """
+        ids = path.split(PATH_SEPARATOR)[:-2]
+        if not ids:
+            return 0
+        return self.get_all_queryset().filter(pk=ids[-1]).update(child_count=F("child_count") + delta)
+
+    def rebase(self, old_path, new_path, depth_delta=0):
+        """
+        Rewrite the paths of a moved subtree in a single update
+        """
+        qs = self.get_all_queryset().filter(path__startswith=old_path)
+        return qs.update(
+            path=Concat(Value(new_path), Substr("path", len(old_path) + 1), output_field=TextField()),
+            depth=F("depth") + depth_delta,
+        )
     
     def count_children(self, file):
-        children = self.children(file, direct=True)
-        return len(children)
+        return self.for_folder(folder=file).count()
 
     def folders_only(self, parent):
-        return self.filter(parent=parent).filter(file_type__name="Folder")
+        return self.filter(parent=parent, kind=FileKind.FOLDER)
     
     def files_only(self, parent):
-        return self.filter(parent=parent).exclude(file_type__name="Folder")
+        return self.filter(parent=parent).exclude(kind=FileKind.FOLDER)
+
+    def of_kind(self, parent, kind):
+        return self.filter(parent=parent, kind=kind)
 
     def for_folder(self, folder):
         return self.filter(parent=folder)
@@ -153,33 +176,220 @@ class FileManager(SoftDeletableManager):
    
     def get_shared(self, user):
         """
-        Retrieve files that have been shared with user or shared with groups to which user is a member
+        Retrieve files that have been shared with user or shared with groups to which user is a member,
+        each once, in listing order and with a single query
         """
-        user_files = self._shared_with_user(user)
-        groups_files = self._user_groups_files(user)
+        UserFile = apps.get_model("drive", "UserFile")
+        GroupFile = apps.get_model("drive", "GroupFile")
+        UserGroup = apps.get_model("drive", "UserGroup")
 
-        files = itertools.chain(user_files, groups_files)
-        unique_files = {}
-        for file in files:
-            unique_files[file.name] = file  # Use file name as key to ensure uniqueness
-        sorted_files = sorted(unique_files.values(), key=operator.attrgetter("name"))
-        return sorted_files
+        groups = UserGroup.objects.filter(user=user).values("group")
+        user_grants = UserFile.objects.filter(file=OuterRef("pk"), user=user)
+        group_grants = GroupFile.objects.filter(file=OuterRef("pk"), group__in=groups)
+        files = self.filter(Exists(user_grants) | Exists(group_grants))
+        return KeysetPaginator.order(files)
 
     def get_trash(self, user):
-        return self.get_all_queryset().filter(modified_by=user, is_removed=True)
+        """
+        Retrieve the files user moved to the trash, without the files trashed along with them
+        """
+        return self.get_all_queryset().filter(trashed_by=user, is_removed=True, trash_root=F("pk"))
 
     def get_recent(self, user):
         return self.for_person(user).order_by("-created")[:5]
 
-    def empty_trash(self, user):
-        items = self.get_trash(user)
-        for item in items:
-            item.delete(soft=False)
+    def get_trash_subtree(self, user):
+        """
+        Trashed files of user and everything below them, deepest first. The
+        trash roots are resolved once, including the files trashed before a
+        folder above them, so slicing the result is an indexed lookup on
+        trash_root.
+        """
+        paths = list(self.get_trash(user).values_list("path", flat=True))
+        if not paths:
+            return self.get_all_queryset().none()
+        below = Q()
+        for path in paths:
+            below |= Q(path__startswith=path)
+        roots = self.get_all_queryset().filter(below, is_removed=True, trash_root=F("pk"))
+        subtree = self.get_all_queryset().filter(trash_root__in=list(roots.values_list("pk", flat=True)))
+        return subtree.order_by("-depth", "pk")
+
+    def purge(self, ids):
+        """
+        Hard delete files and their share grants without loading them or firing
+        delete signals, queueing the blobs they no longer share for reclamation
+        and crediting their size back to their authors, and return how many
+        files were deleted. Children must be purged no later than their parents.
+        """
+        GroupFile = apps.get_model("drive", "GroupFile")
+        UserFile = apps.get_model("drive", "UserFile")
+        BlobReclaim = apps.get_model("drive", "BlobReclaim")
+        UserStorage = apps.get_model("drive", "UserStorage")
+
+        Blob = apps.get_model("drive", "Blob")
+
+        # Rows already purged by a concurrent run are skipped once it commits
+        locked = self.get_all_queryset().filter(pk__in=ids).select_for_update()
+        ids = list(locked.values_list("pk", flat=True))
+        files = self.get_all_queryset().filter(pk__in=ids)
+        names = files.exclude(file="").exclude(file__isnull=True).values_list("file", flat=True)
+        names = Blob.objects.release(list(names))
+        BlobReclaim.objects.bulk_create([BlobReclaim(name=name) for name in names])
+        usage = files.filter(size_bytes__isnull=False).order_by().values("author")
+        usage = usage.annotate(bytes=Sum("size_bytes")).values_list("author", "bytes")
+        UserStorage.release_usage(dict(usage))
+        for model in (GroupFile, UserFile):
+            grants = model.objects.filter(file__in=ids)
+            grants._raw_delete(grants.db)
+        return files._raw_delete(files.db)
     
+    def trash(self, file, user):
+        """
+        Soft delete file together with every live file below it in one update,
+        into the trash of user. Files trashed earlier keep their own trash root.
+        """
+        subtree = self.get_all_queryset().filter(path__startswith=file.path, is_removed=False)
+        return subtree.update(is_removed=True, trash_root=file.pk, trashed_by=user, modified=timezone.now())
+
+    def restore_roots(self, roots):
+        """
+        Restore trashed roots along with the files trashed with them. Roots
+        whose parent is still in the trash go back to the top level, and roots
+        whose name is taken at their destination are renamed. Files that were
+        trashed along with a folder are not roots and are left alone.
+        """
+        roots = [root for root in roots if root.is_removed and root.trash_root == root.pk]
+        if not roots:
+            return 0
+
+        trashed_parents = set(
+            self.get_all_queryset()
+            .filter(pk__in=[root.parent_id for root in roots if root.parent_id], is_removed=True)
+            .exclude(trash_root__in=[root.pk for root in roots])
+            .values_list("pk", flat=True)
+        )
+        for root in roots:
+            if root.parent_id in trashed_parents:
+                root.parent = None
+                root.save()
+
+        taken = self.get_taken_names(roots)
+        renamed = []
+        for root in roots:
+            key = self.get_name_key(root.parent_id, root.group_id, root.author_id)
+            name = root.name
+            counter = 1
+            while (key, name) in taken:
+                stem, extension = os.path.splitext(root.name) if root.original_filename else (root.name, "")
+                name = "%s (%d)%s" % (stem, counter, extension)
+                counter += 1
+            taken.add((key, name))
+            if name != root.name:
+                root.name = name
+                renamed.append(root)
+        if renamed:
+            self.get_all_queryset().bulk_update(renamed, ["name"])
+
+        restored = self.get_all_queryset().filter(trash_root__in=[root.pk for root in roots])
+        count = restored.update(is_removed=False, trash_root=None, trashed_by=None)
+        for root in roots:
+            root.is_removed = False
+            root.update_counters(root.path, 1)
+        return count
+
+    @staticmethod
+    def get_name_key(parent_id, group_id, author_id):
+        if parent_id:
+            return (parent_id, None, None)
+        if group_id:
+            return (None, group_id, None)
+        return (None, None, author_id)
+
+    def get_taken_names(self, files):
+        """
+        Names already used by live files at the destinations of files, in one query
+        """
+        parents = {file.parent_id for file in files if file.parent_id}
+        groups = {file.group_id for file in files if not file.parent_id and file.group_id}
+        authors = {file.author_id for file in files if not file.parent_id and not file.group_id}
+        siblings = self.filter(
+            Q(parent_id__in=parents) |
+            Q(parent__isnull=True, group_id__in=groups) |
+            Q(parent__isnull=True, group__isnull=True, author_id__in=authors)
+        )
+        return {
+            (self.get_name_key(parent_id, group_id, author_id), name)
+            for parent_id, group_id, author_id, name
+            in siblings.values_list("parent_id", "group_id", "author_id", "name")
+        }
+
     def restore_trash(self, user):
-        return self.get_trash(user).update(is_removed=False)
+        return self.restore_roots(self.get_trash(user))
     
     def restore_files(self, user, files):
-        return self.get_trash(user).filter(pk__in=files).update(is_removed=False)
+        return self.restore_roots(self.get_trash(user).filter(pk__in=files))
+
+
 
 
+class BlobManager(models.Manager):
+
+    @staticmethod
+    def hash(content):
+        """
+        SHA-256 digest and size of content, read a chunk at a time
+        """
+        digest, size = hashlib.sha256(), 0
+        for chunk in content.chunks():
+            digest.update(chunk)
+            size += len(chunk)
+        return digest.hexdigest(), size
+
+    def store(self, content, digest=None, size=None, references=1):
+        """
+        Take references to the blob holding content, storing it first if no
+        identical content is stored yet. The reference update locks the blob
+        row until the transaction ends, so a pending reclaim cannot remove the
+        content in the meantime.
+        """
+        if digest is None:
+            digest, size = self.hash(content)
+        name = hookset.blob_upload_to(digest)
+        while True:
+            blob, created = self.get_or_create(digest=digest, defaults={"name": name, "size": size})
+            # No row is updated when a reclaim removed the blob since the get
+            if self.filter(pk=blob.pk).update(ref_count=F("ref_count") + references):
+                break
+        if created or not default_storage.exists(blob.name):
+            self.write(blob.name, content)
+        return blob
+
+    def write(self, name, content):
+        # Content left behind by a rolled back upload is rewritten so the
+        # orphan collector sees it as fresh
+        if default_storage.exists(name):
+            default_storage.delete(name)
+        content.seek(0)
+        saved = default_storage.save(name, content)
+        if saved != name:
+            # Identical content written concurrently under the same name
+            default_storage.delete(saved)
+
+    def release(self, names):
+        """
+        Drop one reference per occurrence of each name, and return the names
+        whose content is no longer referenced, including those stored before
+        blobs were deduplicated
+        """
+        counts = Counter(names)
+        by_count = defaultdict(list)
+        for name, count in counts.items():
+            by_count[count].append(name)
+        for count, batch in by_count.items():
+            self.filter(name__in=batch).update(ref_count=F("ref_count") - count)
+
+        blobs = self.filter(name__in=list(counts))
+        tracked = set(blobs.values_list("name", flat=True))
+        unreferenced = blobs.filter(ref_count__lte=0).values_list("name", flat=True)
+        return [name for name in counts if name not in tracked] + list(unreferenced)
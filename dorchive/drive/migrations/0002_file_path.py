@@ -0,0 +1,44 @@
+# Generated by Django 5.0.14 on 2026-10-17 20:39
+
+from django.db import migrations, models
+
+
+def build_paths(apps, schema_editor):
+    File = apps.get_model("drive", "File")
+    parents = dict(File.objects.values_list("id", "parent_id"))
+    paths = {}
+
+    def resolve(pk):
+        if pk not in paths:
+            parent_id = parents[pk]
+            prefix = resolve(parent_id) if parent_id else ""
+            paths[pk] = "%s%s/" % (prefix, pk.hex)
+        return paths[pk]
+
+    files = []
+    for file in File.objects.only("id").iterator():
+        file.path = resolve(file.pk)
+        file.depth = file.path.count("/") - 1
+        files.append(file)
+    File.objects.bulk_update(files, ["path", "depth"], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drive', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='file',
+            name='depth',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='path',
+            field=models.TextField(db_index=True, default='', editable=False),
+        ),
+        migrations.RunPython(build_paths, migrations.RunPython.noop),
+    ]
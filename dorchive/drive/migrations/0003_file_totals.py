@@ -0,0 +1,44 @@
+# Generated by Django 5.0.14 on 2026-10-17 20:40
+
+from django.db import migrations, models
+
+
+def compute_totals(apps, schema_editor):
+    File = apps.get_model("drive", "File")
+    totals = {}
+    folders = {}
+    for file in File.objects.order_by("-depth").iterator():
+        if file.original_filename is None:
+            file.total_bytes, file.total_files = totals.pop(file.pk, (0, 0))
+            folders[file.pk] = file
+            rollup = (file.total_bytes, file.total_files)
+        else:
+            try:
+                rollup = (file.file.size if file.file else 0, 1)
+            except OSError:
+                rollup = (0, 1)
+        if file.parent_id and not file.is_removed:
+            bytes, files = totals.get(file.parent_id, (0, 0))
+            totals[file.parent_id] = (bytes + rollup[0], files + rollup[1])
+    File.objects.bulk_update(folders.values(), ["total_bytes", "total_files"], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drive', '0002_file_path'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='file',
+            name='total_bytes',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='total_files',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(compute_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.14 on 2026-10-17 20:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drive', '0003_file_totals'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='file',
+            name='size_bytes',
+            field=models.BigIntegerField(blank=True, editable=False, null=True),
+        ),
+    ]
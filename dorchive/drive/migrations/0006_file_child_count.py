@@ -0,0 +1,34 @@
+# Generated by Django 5.0.14 on 2026-10-17 20:42
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def count_children(apps, schema_editor):
+    File = apps.get_model("drive", "File")
+    counts = (
+        File.objects.filter(is_removed=False, parent__isnull=False)
+        .values("parent")
+        .annotate(total=Count("id"))
+        .values_list("parent", "total")
+    )
+    folders = []
+    for pk, total in counts.iterator():
+        folders.append(File(pk=pk, child_count=total))
+    File.objects.bulk_update(folders, ["child_count"], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drive', '0005_file_listing_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='file',
+            name='child_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(count_children, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.0.14 on 2026-10-17 20:43
+
+from django.db import migrations, models
+
+KINDS = {
+    "folder": 1,
+    "file": 2,
+    "docs": 3,
+    "sheets": 4,
+    "slides": 5,
+    "pdf": 6,
+    "text": 7,
+    "picture": 8,
+    "audio": 9,
+    "video": 10,
+    "zip": 11,
+}
+
+
+def set_kinds(apps, schema_editor):
+    File = apps.get_model("drive", "File")
+    for name, kind in KINDS.items():
+        File.objects.filter(file_type__name__iexact=name).update(kind=kind)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drive', '0006_file_child_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='file',
+            name='kind',
+            field=models.PositiveSmallIntegerField(choices=[(1, 'Folder'), (2, 'File'), (3, 'Docs'), (4, 'Sheets'), (5, 'Slides'), (6, 'PDF'), (7, 'Text'), (8, 'Picture'), (9, 'Audio'), (10, 'Video'), (11, 'ZIP')], db_index=True, default=2),
+        ),
+        migrations.RunPython(set_kinds, migrations.RunPython.noop),
+    ]
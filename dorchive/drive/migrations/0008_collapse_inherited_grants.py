@@ -0,0 +1,62 @@
+from django.db import migrations
+from django.db.models import Exists, F, OuterRef, Q
+from django.db.models.lookups import StartsWith
+
+GRANTS = (("GroupFile", "group"), ("UserFile", "user"))
+
+
+def covering_grants(model, recipient):
+    """
+    Grants of the same recipient on a strict ancestor of the outer grant's
+    file with at least the same permissions
+    """
+    return (
+        model.objects.filter(**{recipient: OuterRef(recipient)})
+        .exclude(file=OuterRef("file"))
+        .filter(StartsWith(OuterRef("file__path"), F("file__path")))
+        .filter(Q(can_read=True) | Q(can_read=OuterRef("can_read")))
+        .filter(Q(can_write=True) | Q(can_write=OuterRef("can_write")))
+        .filter(Q(can_delete=True) | Q(can_delete=OuterRef("can_delete")))
+    )
+
+
+def collapse_grants(apps, schema_editor):
+    for model_name, recipient in GRANTS:
+        model = apps.get_model("drive", model_name)
+        model.objects.filter(Exists(covering_grants(model, recipient))).delete()
+
+
+def expand_grants(apps, schema_editor):
+    File = apps.get_model("drive", "File")
+    for model_name, recipient in GRANTS:
+        model = apps.get_model("drive", model_name)
+        folders = model.objects.filter(file__original_filename__isnull=True).select_related("file")
+        for grant in folders.iterator():
+            descendants = (
+                File.objects.filter(path__startswith=grant.file.path)
+                .exclude(pk=grant.file_id)
+                .values_list("pk", flat=True)
+            )
+            objects = [
+                model(
+                    file_id=pk,
+                    shared_by_id=grant.shared_by_id,
+                    can_read=grant.can_read,
+                    can_write=grant.can_write,
+                    can_delete=grant.can_delete,
+                    **{"%s_id" % recipient: getattr(grant, "%s_id" % recipient)}
+                )
+                for pk in descendants.iterator()
+            ]
+            model.objects.bulk_create(objects, batch_size=1000, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drive', '0007_file_kind'),
+    ]
+
+    operations = [
+        migrations.RunPython(collapse_grants, expand_grants),
+    ]
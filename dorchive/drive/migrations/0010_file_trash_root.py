@@ -0,0 +1,31 @@
+# Generated by Django 5.0.14 on 2026-10-17 20:56
+
+from django.db import migrations, models
+
+
+def trash_subtrees(apps, schema_editor):
+    """
+    Make every trashed file the trash root of itself and of the live files
+    below it, deepest first so nested roots keep their own subtrees
+    """
+    File = apps.get_model("drive", "File")
+    roots = File.objects.filter(is_removed=True).order_by("-depth").values_list("pk", "path")
+    for pk, path in list(roots):
+        File.objects.filter(pk=pk).update(trash_root=pk)
+        File.objects.filter(path__startswith=path, is_removed=False).update(is_removed=True, trash_root=pk)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drive', '0009_group_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='file',
+            name='trash_root',
+            field=models.UUIDField(blank=True, db_index=True, editable=False, null=True),
+        ),
+        migrations.RunPython(trash_subtrees, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.0.14 on 2026-10-17 21:16
+
+from django.db import migrations, models
+
+
+def rank_folders(apps, schema_editor):
+    File = apps.get_model("drive", "File")
+    File.objects.filter(original_filename__isnull=True).update(rank=0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drive', '0012_blob'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='file',
+            name='drive_file_listing_idx',
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='rank',
+            field=models.PositiveSmallIntegerField(default=1, editable=False),
+        ),
+        migrations.RunPython(rank_folders, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='file',
+            index=models.Index(fields=['parent', 'rank', 'name', 'id'], name='drive_file_listing_idx'),
+        ),
+    ]
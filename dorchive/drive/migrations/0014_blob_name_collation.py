@@ -0,0 +1,26 @@
+# Generated by Django 5.0.14 on 2026-10-17 21:24
+
+import django.db.models.functions.comparison
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drive', '0013_file_rank'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='blob',
+            index=models.Index(django.db.models.functions.comparison.Collate('name', 'C'), name='drive_blob_name_c_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='blobreclaim',
+            index=models.Index(django.db.models.functions.comparison.Collate('name', 'C'), name='drive_blobreclaim_name_c_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='file',
+            index=models.Index(django.db.models.functions.comparison.Collate('file', 'C'), name='drive_file_file_c_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.0.14 on 2026-10-17 21:31
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def trash_to_authors(apps, schema_editor):
+    # Who trashed a file was not recorded before, so the files already in the
+    # trash go to the trash of their author
+    File = apps.get_model("drive", "File")
+    File.objects.filter(is_removed=True).update(trashed_by=models.F("author"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drive', '0014_blob_name_collation'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='file',
+            name='trashed_by',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(trash_to_authors, migrations.RunPython.noop),
+    ]
@@ -1,16 +1,21 @@
 import itertools
 import math
+from django.contrib.postgres.indexes import GinIndex, OpClass
 from django.db import models
 from django.db.models import F
+from django.db.models.functions import Collate, Greatest, Upper
 from django.contrib.auth import get_user_model
 from django.conf import settings
 from django.urls import reverse
 from model_utils.models import TimeStampedModel, UUIDModel, SoftDeletableModel
 
 from .utils import convert_bytes
-from .exceptions import DuplicateFileError
-from .managers import FileManager, GroupManager
+from .exceptions import DuplicateFileError, InvalidMoveError, QuotaExceededError
+from .managers import BlobManager, FileManager, GroupManager, PATH_SEPARATOR
+from .modifications import modifications
 from .hooks import hookset
+from .registry import FileKind, filetypes
+from .resolvers import PermissionResolver, permission_cache
 
 
 def uuid_filename(instance, filename):
@@ -29,25 +34,19 @@ class FileType(UUIDModel):
     
     @classmethod
     def get_by_name(cls, name):
-        object = cls.objects.filter(name=name).first()
-        if not object:
-            object = FileType.get_file()
-        return object
+        return filetypes.get_by_name(name)
     
     @classmethod
     def get_folder(cls):
-        return FileType.get_by_name("Folder")
+        return filetypes.get_folder()
     
     @classmethod
     def get_file(cls):
-        return FileType.get_by_name("File")
+        return filetypes.get_file()
 
     @classmethod
     def get_by_extension(cls, extension):
-        object = cls.objects.filter(extension=extension).first()
-        if not object:
-            object = FileType.get_file()
-        return object
+        return filetypes.get_by_extension(extension)
 
 
 class Group(UUIDModel, TimeStampedModel, SoftDeletableModel):
@@ -69,6 +68,11 @@ class Group(UUIDModel, TimeStampedModel, SoftDeletableModel):
 
     objects = GroupManager()
 
+    class Meta:
+        indexes = [
+            GinIndex(OpClass(Upper("name"), name="gin_trgm_ops"), name="drive_group_name_trgm_idx"),
+        ]
+
     @staticmethod
     def get_files(group):
         return Group.objects.files(group)
@@ -85,6 +89,9 @@ class Group(UUIDModel, TimeStampedModel, SoftDeletableModel):
 
     def get_members_url(self):
         return reverse("group_members", kwargs={"pk": self.pk})
+
+    def get_member_search_url(self):
+        return reverse("group_search_members", kwargs={"pk": self.pk})
     
     def get_remove_member_url(self):
         return reverse("remove_member", kwargs={"pk": self.pk})
@@ -161,6 +168,12 @@ class FileNavigation(models.Model):
     
     def get_share_people_url(self):
         return reverse("file_share_people", kwargs={"pk": self.pk})
+
+    def get_people_search_url(self):
+        return reverse("file_search_people", kwargs={"pk": self.pk})
+
+    def get_group_search_url(self):
+        return reverse("file_search_groups", kwargs={"pk": self.pk})
     
     def get_remove_group_url(self):
         return reverse("file_remove_group", kwargs={"pk": self.pk})
@@ -206,11 +219,15 @@ class FilePermission(models.Model):
         }
 
     def cascade_permission(self):
-        if self.is_folder:
-            children = self.get_children(direct=False)
-            for child in children:
-                child.set_permissions(self.get_permissions())
-                child.save()
+        """
+        Copy the permissions of a folder onto its whole subtree with a single
+        UPDATE, bypassing the per-row save logic, and return how many files changed
+        """
+        if not self.is_folder():
+            return 0
+        count = File.objects.descendants(self).update(**self.get_permissions())
+        permission_cache.bump_files(self.pk)
+        return count
 
 
 class FileSharing(models.Model):
@@ -226,17 +243,29 @@ class FileSharing(models.Model):
     def user_file_model(cls):
         return UserFile
 
+    def get_inherited_groupfiles(self):
+        """
+        Group grants on this file and on every ancestor, which all apply to it
+        """
+        return GroupFile.objects.filter(file_id__in=self.get_path_ids())
+
+    def get_inherited_userfiles(self):
+        """
+        User grants on this file and on every ancestor, which all apply to it
+        """
+        return UserFile.objects.filter(file_id__in=self.get_path_ids())
+
     def is_shared(self):
         return (
-            self.groupfile_set.filter(folder=self).exists() or 
-            self.userfile_set.filter(folder=self).exists()
+            self.get_inherited_groupfiles().exists() or
+            self.get_inherited_userfiles().exists()
         )
 
     def is_shared_with_group(self, group):
-        return (self.groupfile_set.filter(group=group).exists())
+        return self.get_inherited_groupfiles().filter(group=group).exists()
     
     def is_shared_with_person(self, user):
-        return (self.userfile_set.filter(user=user).exists())
+        return self.get_inherited_userfiles().filter(user=user).exists()
     
     def is_shared_with_groups(self):
         return (self.groupfile_set.filter(file=self).exists())
@@ -244,9 +273,14 @@ class FileSharing(models.Model):
     def is_shared_with_people(self):
         return (self.userfile_set.filter(file=self).exists())
 
-    def get_shared_parent(self):
+    def get_shared_parent(self, group=None, user=None):
+        """
+        Topmost ancestor of the unbroken run of ancestors shared with group or
+        user directly above this file
+        """
         root = self
-        a, b = itertools.tee(reversed(self.get_ancestors()))
+        ancestors = File.objects.ancestors(file=self).with_shared_flag(group=group, user=user)
+        a, b = itertools.tee(reversed(list(ancestors)))
         next(b, None)
         for file, parent in itertools.zip_longest(a, b):
             if file.shared:
@@ -256,17 +290,13 @@ class FileSharing(models.Model):
         return root
 
     def get_shared_groups(self):
-        qs = self.groupfile_set.filter(file=self)
-        if qs.exists():
-            return Group.objects.filter(pk__in=qs.values("groupfile__group"))
-        return Group.objects.none()
+        qs = self.get_inherited_groupfiles()
+        return Group.objects.filter(pk__in=qs.values("group"))
     
     def get_shared_people(self):
-        qs = self.userfile_set.filter(file=self)
+        qs = self.get_inherited_userfiles()
         User = get_user_model()
-        if qs.exists():
-            return User.objects.filter(pk__in=qs.values("user"))
-        return User.objects.none()
+        return User.objects.filter(pk__in=qs.values("user"))
     
     def get_file_groups(self, **kwargs):
         user = kwargs.pop("user", None)
@@ -281,136 +311,123 @@ class FileSharing(models.Model):
         return self.userfile_set.filter(file=self)
     
     def get_non_shared_groups(self):
-        qs = self.groupfile_set.filter(file=self)
-        if qs.exists():
-            return Group.objects.exclude(pk__in=qs.values("group"))
-        return Group.objects.all()
+        qs = self.get_inherited_groupfiles()
+        return Group.objects.exclude(pk__in=qs.values("group"))
         
     def get_non_shared_people(self):
-        qs = self.userfile_set.filter(file=self)
+        qs = self.get_inherited_userfiles()
         User = get_user_model()
-        if qs.exists():
-            return User.objects.exclude(pk__in=qs.values("user"))
-        return User.objects.all()
+        return User.objects.exclude(pk__in=qs.values("user"))
+
+    def _share(self, model, field, recipients, **kwargs):
+        """
+        Grant recipients access to this file with one row each; descendants
+        inherit the grant through their path. Existing grants are updated in
+        place. Return how many grants were added.
+        """
+        permissions = kwargs.pop("permissions")
+        shared_by = kwargs.pop("shared_by", None)
+        recipients = list(recipients)
+        if not recipients:
+            return 0
+
+        existing = model.objects.filter(file=self, **{"%s__in" % field: recipients})
+        before = existing.count()
+        objects = []
+        for recipient in recipients:
+            object = model(file=self, shared_by=shared_by, **{field: recipient})
+            object.set_permissions(permissions)
+            objects.append(object)
+        model.objects.bulk_create(
+            objects,
+            update_conflicts=True,
+            unique_fields=[field, "file"],
+            update_fields=["can_read", "can_write", "can_delete", "shared_by"],
+        )
+        permission_cache.bump_files(self.pk)
+        return existing.count() - before
 
     def add_group(self, group, **kwargs):
-        permissions = kwargs.pop("permissions")
-        user = kwargs.pop("user", None)
-        if not self.is_shared_with_group(group):
-            files = [self] + self.get_children(direct=False)
-            for file in  files:
-                object = GroupFile(file=file, group=group)
-                object.set_permissions(permissions)
-                object.touch(user=user, commit=True)
+        return self.add_groups([group], **kwargs)
 
     def add_groups(self, groups, **kwargs):
-        for group in groups:
-            self.add_group(group, **kwargs)
+        return self._share(GroupFile, "group", groups, **kwargs)
 
     def add_person(self, person, **kwargs):
-        permissions = kwargs.pop("permissions")
-        shared_by = kwargs.pop("shared_by", None)
-        files = [self] + self.get_children(direct=False)
-        for file in files:
-            if not file.is_shared_with_person(person):
-                object = UserFile(file=file, user=person)
-                object.set_permissions(permissions)
-                object.touch(shared_by=shared_by, commit=True)
+        return self.add_people([person], **kwargs)
 
     def add_people(self, users, **kwargs):
-        for person in users:
-            self.add_person(person, **kwargs)
+        return self._share(UserFile, "user", users, **kwargs)
+
+    def _unshare(self, model, field, recipients):
+        """
+        Revoke the grants of recipients on this file and its whole subtree in a
+        single DELETE and return how many were removed
+        """
+        recipients = list(recipients)
+        if not recipients:
+            return 0
+        qs = model.objects.filter(file__path__startswith=self.path, **{"%s__in" % field: recipients})
+        # Skip the per-row delete signals; the subtree is invalidated at once below
+        count = qs._raw_delete(qs.db)
+        permission_cache.bump_files(self.pk)
+        return count
 
     def remove_group(self, group):
-        files = [self] + self.get_children(direct=False)
-        for file in files:
-            if file.is_shared_with_group(group):
-                GroupFile.objects.filter(file=file, group=group).delete()
+        return self.remove_groups([group])
 
     def remove_groups(self, groups):
-        for group in groups:
-           self.remove_group(group)
+        return self._unshare(GroupFile, "group", groups)
 
     def remove_person(self, user):
-        files = [self] + self.get_children(direct=False)
-        for file in files:
-            if file.is_shared_with_person(user):
-                UserFile.objects.filter(file=file, user=user).delete()
+        return self.remove_people([user])
 
     def remove_people(self, users):
-       for user in users:
-           self.remove_person(user)
-    
-    def _shared_group_permissions(self, group):
-        file = GroupFile.objects.filter(group=group, file=self.parent).first()
-        return {
-            "permissions" : file.get_permissions(),
-            "shared_by": file.shared_by
-        }
-
-    def _shared_user_permissions(self, user):
-        file = UserFile.objects.filter(user=user, file=self.parent).first()
-        return {
-            "permissions" : file.get_permissions(),
-            "shared_by": file.shared_by
-        }
-
-    def _cascade_groups_share(self):
-        groups = self.parent.get_shared_groups()
-        for group in groups:
-            kwargs = self._shared_group_permissions(group)
-            self.add_group(group, **kwargs)
-
-    def _cascade_people_share(self):
-        people = self.parent.get_shared_people()
-        for user in people:
-            kwargs = self._shared_user_permissions(user)
-            self.add_person(user, **kwargs)
-
-    def cascade_share(self):
-        if self.has_parent():
-            if self.parent.is_shared_with_groups():
-                self._cascade_groups_share()
-            if self.parent.is_shared_with_people():
-                self._cascade_people_share()
+        return self._unshare(UserFile, "user", users)
 
 
 class FileTypeGuessor(models.Model):
     file_type = models.ForeignKey(FileType,  on_delete=models.CASCADE, blank=True, null=True)
+    kind = models.PositiveSmallIntegerField(choices=FileKind.choices, default=FileKind.FILE, db_index=True)
     class Meta:
         abstract = True
 
     @property
     def icon(self):
-        if self.file_type:
-            return self.file_type.icon
+        file_type = filetypes.get(self.file_type_id)
+        if file_type:
+            return file_type.icon
+
+    def set_file_type(self, file_type):
+        self.file_type = file_type
+        self.kind = FileKind.for_file_type(file_type)
     
     def is_docs(self):
-        return str(self.file_type.name).lower() == "docs"
+        return self.kind == FileKind.DOCS
     
     def is_sheets(self):
-        return str(self.file_type.name).lower() == "sheets"
+        return self.kind == FileKind.SHEETS
     
     def is_slides(self):
-        return str(self.file_type.name).lower() == "slides"
+        return self.kind == FileKind.SLIDES
     
     def is_pdf(self):
-        return str(self.file_type.name).lower() == "pdf"
+        return self.kind == FileKind.PDF
     
     def is_text(self):
-        return str(self.file_type.name).lower() == "text"
+        return self.kind == FileKind.TEXT
     
     def is_picture(self):
-        return str(self.file_type.name).lower() == "picture"
+        return self.kind == FileKind.PICTURE
     
     def is_audio(self):
-        return str(self.file_type.name).lower() == "audio"
+        return self.kind == FileKind.AUDIO
     
     def is_video(self):
-        return str(self.file_type.name).lower() == "video"
+        return self.kind == FileKind.VIDEO
     
     def is_zip(self):
-        return str(self.file_type.name).lower() == "zip"
+        return self.kind == FileKind.ZIP
 
 
 class File(UUIDModel, FileTypeGuessor, FileSharing, FilePermission, FileNavigation, TimeStampedModel, SoftDeletableModel):
@@ -418,6 +435,7 @@ class File(UUIDModel, FileTypeGuessor, FileSharing, FilePermission, FileNavigati
     description = models.CharField(max_length=255, blank=True, null=True)
     file = models.FileField(upload_to=uuid_filename, blank=True, null=True)
     original_filename = models.CharField(max_length=500, blank=True, null=True)
+    size_bytes = models.BigIntegerField(blank=True, null=True, editable=False)
     published = models.BooleanField(default=False)
     parent = models.ForeignKey(
         'self', 
@@ -441,9 +459,45 @@ class File(UUIDModel, FileTypeGuessor, FileSharing, FilePermission, FileNavigati
         related_name="file_modifier", 
         on_delete=models.CASCADE
     )
+    path = models.TextField(default="", db_index=True, editable=False)
+    depth = models.PositiveIntegerField(default=0, editable=False)
+    total_bytes = models.BigIntegerField(default=0, editable=False)
+    total_files = models.BigIntegerField(default=0, editable=False)
+    child_count = models.PositiveIntegerField(default=0, editable=False)
+    trash_root = models.UUIDField(blank=True, null=True, db_index=True, editable=False)
+    trashed_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL, 
+        related_name="+", 
+        on_delete=models.SET_NULL, 
+        blank=True, null=True, editable=False
+    )
+    # Stored so listings put folders first straight from the listing index
+    rank = models.PositiveSmallIntegerField(default=1, editable=False)
     
     objects = FileManager()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["parent", "rank", "name", "id"], name="drive_file_listing_idx"),
+            # Byte ordered blob names, streamed by the orphan collector
+            models.Index(Collate("file", "C"), name="drive_file_file_c_idx"),
+        ]
+
+    FOLDER_RANK = 0
+    FILE_RANK = 1
+
+    COUNTER_FIELDS = ("total_bytes", "total_files", "child_count")
+    ACL_FIELDS = ("parent_id", "group_id", "author_id", "can_read", "can_write", "can_delete")
+
+    _ancestors = None
+    _saved_acl = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._saved_acl = instance.get_acl_state()
+        return instance
+
     @classmethod
     def already_exists(cls, name, parent, group):
         return cls.objects.filter(name=name,parent=parent,group=group).exists()
@@ -471,14 +525,17 @@ class File(UUIDModel, FileTypeGuessor, FileSharing, FilePermission, FileNavigati
         return self.name
 
     def __set_as_file(self):
-        split_file = str(self.file).split(".")
-        extension = split_file[1]
-        file_type = FileType.get_by_extension(extension)
-        self.file_type = file_type
+        self.rank = self.FILE_RANK
+        uploading = not self.file._committed
+        if self.file_type_id is None or uploading:
+            filename = self.original_filename or self.file.name
+            content = self.file if uploading else None
+            self.set_file_type(filetypes.classify(filename, content))
 
     def __set_as_folder(self):
-        file_type = FileType.get_folder()
-        self.file_type = file_type
+        self.rank = self.FOLDER_RANK
+        if self.file_type_id is None:
+            self.set_file_type(filetypes.get_folder())
 
     def is_folder(self):
         return self.original_filename is None
@@ -491,10 +548,35 @@ class File(UUIDModel, FileTypeGuessor, FileSharing, FilePermission, FileNavigati
 
     def get_size(self):
         if self.file:
-            return self.file.size
+            return self.size_bytes
         else:
-            children = self.get_children(direct=True)
-            return sum([member.size for member in children ])
+            return self.total_bytes
+
+    def get_acl_state(self):
+        """
+        Loaded values of the fields permissions are derived from
+        """
+        return tuple(self.__dict__.get(field) for field in self.ACL_FIELDS)
+
+    def get_saved_fields(self):
+        """
+        Fields written by a regular save, leaving the counters maintained
+        through atomic updates untouched
+        """
+        return [
+            field.name for field in self._meta.concrete_fields
+            if not field.primary_key and field.name not in self.COUNTER_FIELDS
+        ]
+
+    def get_rollup(self):
+        """
+        Bytes and files this entry adds to the totals of its ancestors
+        """
+        if self.is_folder():
+            totals = File.all_objects.filter(pk=self.pk).values_list("total_bytes", "total_files")
+            self.total_bytes, self.total_files = totals.get()
+            return self.total_bytes, self.total_files
+        return self.size_bytes or 0, 1
         
     def get_bytes(self):
         size = self.get_size()
@@ -505,21 +587,42 @@ class File(UUIDModel, FileTypeGuessor, FileSharing, FilePermission, FileNavigati
         return File.objects.children(file=self, **kwargs)
     
     def count_children(self):
-        return File.objects.count_children(file=self, direct=True)
+        return self.child_count
     
     def has_children(self):
-        count = self.count_children()
-        return count > 0
+        return self.child_count > 0
 
     def get_ancestors(self):
-        ancestors = []
-        if self.parent:
-            ancestors.extend(self.parent.get_ancestors())
-            ancestors.append(self.parent)
-        return ancestors
+        """
+        Ancestors root first, fetched once per instance
+        """
+        if self._ancestors is None:
+            self._ancestors = list(File.objects.ancestors(file=self))
+        return self._ancestors
 
     def has_ancestors(self):
-        return len(self.get_ancestors()) > 0
+        return self.depth > 0
+
+    def get_ancestor_ids(self):
+        """
+        Ids of all ancestors, root first, read from the materialized path
+        """
+        return self.path.split(PATH_SEPARATOR)[:-2]
+
+    def get_path_ids(self):
+        """
+        Ids of all ancestors followed by the id of this file
+        """
+        return self.path.split(PATH_SEPARATOR)[:-1]
+
+    def is_descendant_of(self, file):
+        return self.pk != file.pk and self.path.startswith(file.path)
+
+    def build_path(self):
+        segment = "%s%s" % (self.pk.hex, PATH_SEPARATOR)
+        if self.parent:
+            return self.parent.path + segment
+        return segment
     
     def is_duplicate(self):
         return File.already_exists(self.name, self.parent, self.drive)
@@ -533,11 +636,12 @@ class File(UUIDModel, FileTypeGuessor, FileSharing, FilePermission, FileNavigati
     def touch(self, user, commit=True):
         self.modified_by = user
         if commit:
-            if self.parent:
-                self.parent.touch(user)
             self.save()
+            modifications.touch(self.get_ancestor_ids(), user)
 
     def move(self, destination):
+        if destination is not None and (destination.pk == self.pk or destination.is_descendant_of(self)):
+            raise InvalidMoveError(f"{self.name} cannot be moved into itself.")
         self.parent = destination
         self.save()
 
@@ -549,8 +653,68 @@ class File(UUIDModel, FileTypeGuessor, FileSharing, FilePermission, FileNavigati
         else:
             self.__set_as_file()
         
+        if self.file and not self.file._committed:
+            self.store_blob()
+        elif self.file and self.size_bytes is None:
+            self.size_bytes = self.file.size
+
         self.touch(self.author, commit=False)
+
+        adding = self._state.adding
+        acl_changed = not adding and self._saved_acl != self.get_acl_state()
+        previous_path, previous_depth = self.path, self.depth
+        self.path = self.build_path()
+        self.depth = self.path.count(PATH_SEPARATOR) - 1
+        if not adding and kwargs.get("update_fields") is None:
+            kwargs["update_fields"] = self.get_saved_fields()
         super().save(**kwargs)
+        self._saved_acl = self.get_acl_state()
+
+        if acl_changed:
+            permission_cache.bump_files(self.pk)
+        if previous_path and previous_path != self.path:
+            self._ancestors = None
+            File.objects.rebase(previous_path, self.path, self.depth - previous_depth)
+            if not self.is_removed:
+                self.update_counters(previous_path, -1)
+                self.update_counters(self.path, 1)
+        elif adding and not self.is_removed:
+            self.update_counters(self.path, 1)
+
+    def store_blob(self):
+        """
+        Store the uploaded content under its digest, sharing the blob of any
+        identical upload
+        """
+        blob = Blob.objects.store(self.file)
+        self.file = blob.name
+        self.size_bytes = blob.size
+
+    def update_counters(self, path, sign):
+        """
+        Add (sign=1) or withdraw (sign=-1) this entry from the counters of
+        the ancestors in path
+        """
+        bytes, files = self.get_rollup()
+        File.objects.rollup(path, sign * bytes, sign * files)
+        File.objects.count_child(path, sign)
+
+    def delete(self, using=None, soft=True, *args, user=None, **kwargs):
+        """
+        Move this file and everything below it to the trash of user, the
+        author unless given, or delete it for good when soft is False
+        """
+        if not soft:
+            if not self.is_removed:
+                self.update_counters(self.path, -1)
+            return super().delete(using, soft, *args, **kwargs)
+        if not self.is_removed:
+            user = user or self.author
+            self.update_counters(self.path, -1)
+            File.objects.trash(self, user)
+            self.is_removed = True
+            self.trash_root = self.pk
+            self.trashed_by = user
 
     def unique_id(self):
         return "f-%d" % self.pk
@@ -559,8 +723,16 @@ class File(UUIDModel, FileTypeGuessor, FileSharing, FilePermission, FileNavigati
         self.delete(soft=False)
 
     def restore(self):
-        self.is_removed = False
-        self.save()
+        """
+        Restore this file together with everything trashed along with it.
+        A file trashed with one of its folders restores that folder.
+        """
+        if self.is_removed:
+            root = self
+            if self.trash_root is not None and self.trash_root != self.pk:
+                root = File.all_objects.get(pk=self.trash_root)
+            File.objects.restore_roots([root])
+            self.refresh_from_db(fields=["name", "parent", "path", "depth", "is_removed", "trash_root", "trashed_by"])
 
     @staticmethod
     def for_person(user):
@@ -628,11 +800,6 @@ class GroupFile(ShareFile):
     class Meta:
         unique_together = [("group", "file")]
 
-    @classmethod
-    def for_group(cls, group):
-        qs = cls._default_manager.filter(group=group)
-        return qs.values_list(cls.obj_attr)
-
 
 class UserFile(ShareFile):
     user = models.ForeignKey(
@@ -643,11 +810,6 @@ class UserFile(ShareFile):
     class Meta:
         unique_together = [("user", "file")]
 
-    @classmethod
-    def for_user(cls, user):
-        qs = cls._default_manager.filter(user=user)
-        return qs.values_list(cls.obj_attr)
-
 
 class UserGroup(UUIDModel, TimeStampedModel):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
@@ -682,6 +844,68 @@ class UserStorage(UUIDModel):
         storage_qs = UserStorage.objects.filter(pk=self.pk)
         storage_qs.update(bytes_used=F("bytes_used") - bytes)
 
+    def reserve_usage(self, bytes):
+        """
+        Charge bytes only if they fit in bytes_total. The conditional update
+        locks the row until the transaction ends, so concurrent uploads are
+        checked one after another and cannot overshoot the quota.
+        """
+        storage_qs = UserStorage.objects.filter(pk=self.pk, bytes_used__lte=F("bytes_total") - bytes)
+        if not storage_qs.update(bytes_used=F("bytes_used") + bytes):
+            raise QuotaExceededError(f"{convert_bytes(bytes)} exceeds the space left.")
+
+    @staticmethod
+    def release_usage(usage):
+        """
+        Credit back the bytes freed by permanent deletes, given as a mapping of
+        user ids to bytes. Usage never drops below zero, as files uploaded
+        before usage was charged are only accounted for by reconciliation.
+        """
+        for user_id, bytes in usage.items():
+            if bytes:
+                storage_qs = UserStorage.objects.filter(user_id=user_id)
+                storage_qs.update(bytes_used=Greatest(F("bytes_used") - bytes, 0))
+
+
+class Blob(UUIDModel, TimeStampedModel):
+    """
+    Stored content shared by every file with the same SHA-256 digest, removed
+    once no file references it anymore
+    """
+    digest = models.CharField(max_length=64, unique=True)
+    name = models.CharField(max_length=255, unique=True)
+    size = models.BigIntegerField(default=0)
+    ref_count = models.IntegerField(default=0)
+
+    objects = BlobManager()
+
+    class Meta:
+        indexes = [
+            models.Index(Collate("name", "C"), name="drive_blob_name_c_idx"),
+        ]
+
+    def __str__(self):
+        return self.name
+
+
+class BlobReclaim(UUIDModel, TimeStampedModel):
+    """
+    Stored blob of a deleted file, waiting to be removed from storage once the
+    transaction that deleted the file has committed
+    """
+    name = models.CharField(max_length=255)
+    attempts = models.PositiveSmallIntegerField(default=0)
+
+    MAX_ATTEMPTS = 5
+
+    class Meta:
+        indexes = [
+            models.Index(Collate("name", "C"), name="drive_blobreclaim_name_c_idx"),
+        ]
+
+    def __str__(self):
+        return self.name
+
 
 class DriveMixin(models.Model):
 
@@ -706,72 +930,33 @@ class DriveMixin(models.Model):
     class Meta:
         abstract = True
   
-    def _has_direct_permission(self, file, permission):
-        try:
-            action_name = "can_%s" % permission
-            if file.group and self.is_group_member(file.group) and getattr(file, action_name) == True:
-                return True
-            return False
-        except:
-            return False
-
-    def _has_user_file_permission(self, file, permission):
-        try: 
-            action_name = "can_%s" % permission
-            user_file = UserFile.objects.filter(file=file, user=self).first()
-            if user_file and getattr(user_file, action_name) == True:
-                return True
-            return False
-        except:
-            return False
-       
-    def _has_group_file_permission(self, file, permission):
-        action_name = "can_%s" % permission
-        try:
-            groups = self.usergroups.all()
-            group_file = GroupFile.objects.filter(file=file, group__in=groups).first()
-            if group_file and getattr(group_file, action_name) == True:
-                return True
-            return False
-        except:
-            return False
+    def get_permission_resolver(self):
+        resolver = getattr(self, "_permission_resolver", None)
+        if resolver is None:
+            resolver = PermissionResolver(self)
+            self._permission_resolver = resolver
+        return resolver
         
     def get_groups(self):
         groups = Group.objects.for_user(user=self) 
         return groups
    
     def is_group_admin(self, group):
-        return UserGroup.objects.filter(group=group, user=self, is_admin=True).exists()
+        return self.get_permission_resolver().is_group_admin(group)
     
     def is_group_member(self, group):
-        return UserGroup.objects.filter(group=group, user=self).exists()
+        return self.get_permission_resolver().is_group_member(group)
 
     def is_file_author(self, file):
-        return file.author.pk == self.pk
+        return file.author_id == self.pk
     
     def is_file_admin(self, file):
-        if file.group and self.is_group_admin(file.group):
+        if file.group_id and self.is_group_admin(file.group_id):
             return True
         return False
    
     def has_file_permission(self, file, permission):
-
-        if self._has_direct_permission(file, permission):
-            return True
-    
-        if self.is_file_author(file):
-            return True
-        
-        if self.is_file_admin(file):
-            return True
-        
-        if self._has_user_file_permission(file, permission):
-            return True
-        
-        if self._has_group_file_permission(file, permission):
-            return True
-        
-        return False
+        return self.get_permission_resolver().has_permission(file, permission)
 
     def can_access(self, file):
         return (
@@ -789,3 +974,6 @@ class DriveMixin(models.Model):
     def can_delete(self, file):
         return self.has_file_permission(file, "delete")
 
+    def can_share(self, file):
+        return self.has_file_permission(file, "share")
+
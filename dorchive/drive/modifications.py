@@ -0,0 +1,52 @@
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.apps import apps
+from django.utils import timezone
+
+
+class ModificationTracker:
+    """
+    Propagate modified/modified_by to the ancestors of changed files with one
+    UPDATE per user. Inside coalesce() the ancestors are collected and each is
+    updated once when the block exits, however many files below it changed.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def _pending(self):
+        return getattr(self._local, "pending", None)
+
+    @contextmanager
+    def coalesce(self):
+        if self._pending() is not None:
+            yield
+            return
+        self._local.pending = defaultdict(set)
+        try:
+            yield
+            pending = self._local.pending
+        finally:
+            self._local.pending = None
+        for user, ids in pending.items():
+            self.flush(ids, user)
+
+    def touch(self, ids, user):
+        pending = self._pending()
+        if pending is not None:
+            pending[user].update(ids)
+        else:
+            self.flush(ids, user)
+
+    def flush(self, ids, user):
+        if not ids:
+            return 0
+        File = apps.get_model("drive", "File")
+        return File.all_objects.filter(pk__in=list(ids)).update(
+            modified=timezone.now(), modified_by=user
+        )
+
+
+modifications = ModificationTracker()
@@ -0,0 +1,119 @@
+import heapq
+import posixpath
+from collections import namedtuple
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db.models.functions import Collate
+from django.utils import timezone
+
+from .hooks import UPLOAD_DIR
+from .models import Blob, BlobReclaim, File
+
+OrphanScan = namedtuple("OrphanScan", ["scanned", "found", "deleted", "last"])
+
+
+class OrphanCollector:
+    """
+    Find blobs under the upload directory that no file references.
+
+    The storage listing and the referenced names are both streamed in the same
+    byte order and merged, so memory stays bounded by a single directory
+    listing and one database chunk however many blobs are stored. Blobs newer
+    than the grace period are left alone, as their upload may not have
+    committed yet.
+    """
+    collation = "C"
+
+    def __init__(self, storage=None, directory=UPLOAD_DIR, grace=None, batch_size=2000, delete=False):
+        self.storage = storage or default_storage
+        self.directory = directory
+        if grace is None:
+            grace = timedelta(hours=getattr(settings, "DRIVE_ORPHAN_GRACE_HOURS", 24))
+        self.grace = grace
+        self.batch_size = batch_size
+        self.delete = delete
+
+    def iter_stored(self, after=None):
+        """
+        Names of the stored blobs in byte order, starting after the given name
+        """
+        if self.storage.exists(self.directory):
+            yield from self._walk(self.directory, after)
+
+    def _walk(self, directory, after):
+        dirs, files = self.storage.listdir(directory)
+        # A trailing slash sorts each directory among its siblings exactly
+        # where the names below it sort
+        entries = [(posixpath.join(directory, name) + "/", True) for name in dirs]
+        entries += [(posixpath.join(directory, name), False) for name in files]
+        for key, is_dir in sorted(entries):
+            if after is not None and key <= after and not (is_dir and after.startswith(key)):
+                continue
+            if is_dir:
+                yield from self._walk(key.rstrip("/"), after)
+            else:
+                yield key
+
+    def _names(self, queryset, field, after=None):
+        queryset = queryset.annotate(key=Collate(field, self.collation)).filter(
+            key__startswith=self.directory + "/"
+        )
+        if after is not None:
+            queryset = queryset.filter(key__gt=after)
+        names = queryset.order_by("key").values_list("key", flat=True)
+        return names.iterator(chunk_size=self.batch_size)
+
+    def iter_referenced(self, after=None):
+        """
+        Names of the blobs referenced by files, trashed ones included, of the
+        blobs being shared, and of those already queued for reclaim, in byte
+        order
+        """
+        return heapq.merge(
+            self._names(File.all_objects.all(), "file", after),
+            self._names(Blob.objects.all(), "name", after),
+            self._names(BlobReclaim.objects.all(), "name", after),
+        )
+
+    def is_expired(self, name, cutoff):
+        try:
+            return self.storage.get_modified_time(name) < cutoff
+        except (NotImplementedError, OSError):
+            return False
+
+    def collect(self, after=None, limit=None, callback=None):
+        """
+        Scan up to limit stored blobs after the given name, deleting orphans
+        older than the grace period when delete is set. The returned last name
+        resumes the scan, and is None once the listing is exhausted.
+        """
+        cutoff = timezone.now() - self.grace
+        referenced = self.iter_referenced(after)
+        current = next(referenced, None)
+        scanned = found = deleted = 0
+        last = None
+
+        for name in self.iter_stored(after):
+            if limit is not None and scanned >= limit:
+                return OrphanScan(scanned, found, deleted, last)
+            scanned += 1
+            last = name
+            while current is not None and current < name:
+                current = next(referenced, None)
+            if name == current or not self.is_expired(name, cutoff):
+                continue
+
+            found += 1
+            if self.delete:
+                try:
+                    self.storage.delete(name)
+                except OSError:
+                    if callback:
+                        callback(name, False)
+                    continue
+                deleted += 1
+            if callback:
+                callback(name, self.delete)
+        return OrphanScan(scanned, found, deleted, None)
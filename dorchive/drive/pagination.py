@@ -0,0 +1,128 @@
+import base64
+import binascii
+import json
+import uuid
+from urllib.parse import urlencode
+
+from django.core.paginator import InvalidPage
+from django.db.models import Func, TextField, Value
+from django.db.models.lookups import GreaterThan
+from django.http import Http404
+from django.urls import reverse
+
+
+class Row(Func):
+    """
+    Row value, compared element by element so a keyset predicate is a single
+    range over a composite index
+    """
+    template = "(%(expressions)s)"
+    output_field = TextField()
+
+
+class KeysetPage:
+
+    def __init__(self, object_list, next_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+
+class KeysetPaginator:
+    """
+    Paginate file listings by cursor on (rank, name, id), which puts folders
+    first, so every page is a single range scan of the listing index
+    regardless of its position.
+    """
+    ordering = ("rank", "name", "id")
+    max_rank = 2 ** 15 - 1
+
+    def __init__(self, queryset, per_page=50):
+        self.queryset = self.order(queryset)
+        self.per_page = per_page
+
+    @classmethod
+    def order(cls, queryset):
+        return queryset.order_by(*cls.ordering)
+
+    @staticmethod
+    def encode_cursor(file):
+        key = [file.rank, file.name, file.pk.hex]
+        data = json.dumps(key).encode()
+        return base64.urlsafe_b64encode(data).decode()
+
+    @classmethod
+    def decode_cursor(cls, cursor):
+        try:
+            rank, name, pk = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            rank, name, pk = int(rank), str(name), uuid.UUID(pk)
+        except (AttributeError, binascii.Error, TypeError, ValueError):
+            return None
+        # Keys the listing columns cannot hold would fail in the database
+        if not 0 <= rank <= cls.max_rank or "\x00" in name:
+            return None
+        return rank, name, pk
+
+    def page(self, cursor=None):
+        """
+        The page after cursor, or the first page without one. Cursors that do
+        not decode raise InvalidPage.
+        """
+        qs = self.queryset
+        if cursor:
+            key = self.decode_cursor(cursor)
+            if key is None:
+                raise InvalidPage("Invalid cursor.")
+            qs = qs.filter(GreaterThan(Row(*self.ordering), Row(*map(Value, key))))
+        object_list = list(qs[:self.per_page + 1])
+        next_cursor = None
+        if len(object_list) > self.per_page:
+            object_list = object_list[:self.per_page]
+            next_cursor = self.encode_cursor(object_list[-1])
+        return KeysetPage(object_list, next_cursor)
+
+
+class KeysetPaginationMixin:
+    """
+    Render one page of files and link to the fragment that continues the list.
+    """
+    paginate_by = 50
+    cursor_kwarg = "cursor"
+    page_url_name = None
+
+    def paginate_files(self, files):
+        # Every row names its owner
+        files = files.select_related("author", "group")
+        paginator = KeysetPaginator(files, per_page=self.paginate_by)
+        try:
+            return paginator.page(self.request.GET.get(self.cursor_kwarg))
+        except InvalidPage as error:
+            raise Http404(str(error)) from error
+
+    def get_page_url_kwargs(self):
+        if "pk" in self.kwargs:
+            return {"pk": self.kwargs["pk"]}
+        return {}
+
+    def get_next_page_url(self, page):
+        if self.page_url_name is None or not page.has_next():
+            return None
+        url = reverse(self.page_url_name, kwargs=self.get_page_url_kwargs())
+        return "%s?%s" % (url, urlencode({self.cursor_kwarg: page.next_cursor}))
+
+    def get_page_context(self, files, **context):
+        page = self.paginate_files(files)
+        self.request.user.get_permission_resolver().prime(page.object_list)
+        context.update({
+            "files": page,
+            "next_page_url": self.get_next_page_url(page),
+        })
+        return context
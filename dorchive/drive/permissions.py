@@ -73,7 +73,7 @@ class GroupAdminPermission:
         group = get_object_or_404(queryset, pk=pk)
         user = self.request.user
 
-        if not group.is_public and user.is_group_admin(group):
+        if not group.is_public and not user.is_group_admin(group):
             raise Http404("You do not have permission as group admin.")
         return group
 
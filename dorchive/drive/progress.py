@@ -0,0 +1,61 @@
+from django.core.cache import cache
+
+
+class TrashProgress:
+    """
+    Progress of the background job emptying the trash of a user, kept in the
+    shared cache so any process can report it
+    """
+    prefix = "drive:trash"
+    timeout = 60 * 60
+    # Every batch refreshes a running job, so one left queued or running this
+    # long died without reporting and no longer blocks emptying the trash
+    stale_timeout = 10 * 60
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+    def key(self, user_id):
+        return "%s:%s" % (self.prefix, user_id)
+
+    def lock_key(self, user_id):
+        return "%s:lock" % self.key(user_id)
+
+    def get(self, user_id):
+        return cache.get(self.key(user_id))
+
+    def set(self, user_id, state, total=0, deleted=0):
+        progress = {"state": state, "total": total, "deleted": deleted}
+        if state in (self.QUEUED, self.RUNNING):
+            cache.set_many({self.key(user_id): progress, self.lock_key(user_id): True}, self.stale_timeout)
+        else:
+            cache.set(self.key(user_id), progress, self.timeout)
+            cache.delete(self.lock_key(user_id))
+        return progress
+
+    def start(self, user_id):
+        """
+        Queue a job unless one is already queued or running, and return its
+        progress, or None when it was not queued. The lock is taken with a
+        single add, so concurrent requests queue one job between them.
+        """
+        if not cache.add(self.lock_key(user_id), True, self.stale_timeout):
+            return None
+        return self.set(user_id, self.QUEUED)
+
+    def update(self, user_id, total, deleted):
+        return self.set(user_id, self.RUNNING, total, deleted)
+
+    def finish(self, user_id, total, deleted):
+        return self.set(user_id, self.DONE, total, deleted)
+
+    def fail(self, user_id, total, deleted):
+        return self.set(user_id, self.FAILED, total, deleted)
+
+    def is_running(self, user_id):
+        return cache.get(self.lock_key(user_id)) is not None
+
+
+trash_progress = TrashProgress()
@@ -1,8 +1,10 @@
-from django.db.models.signals import post_save, pre_delete, post_delete
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
-from django.core.files.storage import default_storage
 from django.conf import settings
-from .models import File, UserStorage
+from .models import Blob, BlobReclaim, Document, File, FileType, GroupFile, UserFile, UserGroup, UserStorage
+from .registry import filetypes
+from .resolvers import permission_cache
+from .tasks import schedule_reclaim
 
 
 @receiver(post_save, sender=settings.AUTH_USER_MODEL)
@@ -11,15 +13,34 @@ def ensure_userstorage(sender, **kwargs):
         user = kwargs["instance"]
         UserStorage.objects.create(user=user, bytes_total=(1024 * 1024 * 50))
 		
-@receiver(pre_delete, sender=File)
-def file_delete(sender, instance, **kwargs):
-    instance.file.delete(False)
+@receiver(post_delete, sender=File)
+@receiver(post_delete, sender=Document)
+def queue_blob_reclaim(sender, instance, **kwargs):
+    if instance.file:
+        names = Blob.objects.release([instance.file.name])
+        if names:
+            BlobReclaim.objects.bulk_create([BlobReclaim(name=name) for name in names])
+            schedule_reclaim()
 
 @receiver(post_delete, sender=File)
-def delete_file_storage(sender, instance, **kwags):
-    try:
-        path = instance.file.path
-        if path:
-            default_storage.delete(path)
-    except:
-        pass
+@receiver(post_delete, sender=Document)
+def release_storage(sender, instance, **kwargs):
+    if instance.size_bytes:
+        UserStorage.release_usage({instance.author_id: instance.size_bytes})
+
+@receiver(post_save, sender=FileType)
+@receiver(post_delete, sender=FileType)
+def invalidate_filetypes(sender, **kwargs):
+    filetypes.invalidate()
+
+@receiver(post_save, sender=GroupFile)
+@receiver(post_delete, sender=GroupFile)
+@receiver(post_save, sender=UserFile)
+@receiver(post_delete, sender=UserFile)
+def invalidate_file_permissions(sender, instance, **kwargs):
+    permission_cache.bump_files(instance.file_id)
+
+@receiver(post_save, sender=UserGroup)
+@receiver(post_delete, sender=UserGroup)
+def invalidate_user_permissions(sender, instance, **kwargs):
+    permission_cache.bump_user(instance.user_id)
@@ -0,0 +1,174 @@
+import os
+import time
+import uuid
+from collections import namedtuple
+
+from django.apps import apps
+from django.core.cache import cache
+from django.db import models, transaction
+
+FOLDER = "Folder"
+FILE = "File"
+
+FileTypeMaps = namedtuple("FileTypeMaps", ["by_id", "by_name", "by_extension"])
+
+
+class FileKind(models.IntegerChoices):
+    FOLDER = 1, "Folder"
+    FILE = 2, "File"
+    DOCS = 3, "Docs"
+    SHEETS = 4, "Sheets"
+    SLIDES = 5, "Slides"
+    PDF = 6, "PDF"
+    TEXT = 7, "Text"
+    PICTURE = 8, "Picture"
+    AUDIO = 9, "Audio"
+    VIDEO = 10, "Video"
+    ZIP = 11, "ZIP"
+
+    @classmethod
+    def for_file_type(cls, file_type):
+        if file_type is None:
+            return cls.FILE
+        return KINDS_BY_NAME.get(file_type.name.lower(), cls.FILE)
+
+
+KINDS_BY_NAME = {kind.label.lower(): kind for kind in FileKind}
+
+# Leading bytes of common formats mapped to the extension they are stored under
+SIGNATURES = [
+    (0, b"%PDF", "pdf"),
+    (0, b"\x89PNG\r\n\x1a\n", "png"),
+    (0, b"\xff\xd8\xff", "jpg"),
+    (0, b"GIF87a", "gif"),
+    (0, b"GIF89a", "gif"),
+    (0, b"ID3", "mp3"),
+    (0, b"\xff\xfb", "mp3"),
+    (8, b"WAVE", "wav"),
+    (8, b"AVI ", "avi"),
+    (4, b"ftyp", "mp4"),
+    (0, b"\x1a\x45\xdf\xa3", "mkv"),
+    (0, b"\x30\x26\xb2\x75\x8e\x66\xcf\x11", "wmv"),
+    (0, b"\x00\x00\x01\xba", "mpeg"),
+    (0, b"PK\x03\x04", "zip"),
+]
+SNIFF_LENGTH = 16
+
+
+def get_extension(filename):
+    extension = os.path.splitext(str(filename or ""))[1]
+    return extension.lstrip(".").lower()
+
+
+def sniff_extension(content):
+    """
+    Guess the extension of an uploaded file from its leading bytes
+    """
+    try:
+        position = content.tell()
+        content.seek(0)
+        header = content.read(SNIFF_LENGTH)
+        content.seek(position)
+    except (AttributeError, OSError, ValueError):
+        return None
+    for offset, signature, extension in SIGNATURES:
+        if header[offset:offset + len(signature)] == signature:
+            return extension
+    return None
+
+
+class FileTypeRegistry:
+    """
+    Process wide cache of FileType rows keyed by name and extension.
+
+    Changes to FileType bump a version held in the shared cache; every process
+    compares it at most once per check_interval seconds and reloads when stale.
+    """
+    version_key = "drive:filetype:version"
+    check_interval = 60
+
+    def __init__(self):
+        self._maps = None
+        self._version = None
+        self._checked = 0
+
+    def _model(self):
+        return apps.get_model("drive", "FileType")
+
+    def _current_version(self):
+        version = cache.get(self.version_key)
+        if version is None:
+            cache.add(self.version_key, uuid.uuid4().hex, None)
+            version = cache.get(self.version_key)
+        return version
+
+    def load(self):
+        version = self._current_version()
+        by_id, by_name, by_extension = {}, {}, {}
+        for file_type in self._model().objects.all():
+            by_id[file_type.pk] = file_type
+            by_name.setdefault(file_type.name.lower(), file_type)
+            if file_type.extension:
+                by_extension.setdefault(file_type.extension.lower(), file_type)
+        # Swapped in with a single assignment, so a concurrent reader sees
+        # either the old maps or the new ones
+        self._maps = FileTypeMaps(by_id, by_name, by_extension)
+        self._version = version
+        self._checked = time.monotonic()
+
+    def _ensure_loaded(self):
+        if self._maps is None:
+            self.load()
+        elif time.monotonic() - self._checked > self.check_interval:
+            self._checked = time.monotonic()
+            if self._current_version() != self._version:
+                self.load()
+        return self._maps
+
+    def invalidate(self):
+        # Bumped once committed, so no process reloads the old rows under the
+        # new version
+        transaction.on_commit(self._bump)
+
+    def _bump(self):
+        cache.set(self.version_key, uuid.uuid4().hex, None)
+        self.load()
+
+    def get(self, pk):
+        return self._ensure_loaded().by_id.get(pk)
+
+    def get_by_name(self, name):
+        file_type = self._ensure_loaded().by_name.get(str(name).lower())
+        if file_type is None and str(name).lower() != FILE.lower():
+            return self.get_file()
+        return file_type
+
+    def get_by_extension(self, extension):
+        file_type = self._ensure_loaded().by_extension.get(str(extension).lower())
+        if file_type is None:
+            return self.get_file()
+        return file_type
+
+    def get_folder(self):
+        return self.get_by_name(FOLDER)
+
+    def get_file(self):
+        return self.get_by_name(FILE)
+
+    def classify(self, filename, content=None):
+        """
+        Resolve the FileType of filename, sniffing content when the extension
+        is missing or unknown
+        """
+        by_extension = self._ensure_loaded().by_extension
+        extension = get_extension(filename)
+        if extension in by_extension:
+            return by_extension[extension]
+        if content is not None:
+            extension = sniff_extension(content)
+            if extension in by_extension:
+                return by_extension[extension]
+        return self.get_file()
+
+
+filetypes = FileTypeRegistry()
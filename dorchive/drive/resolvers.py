@@ -0,0 +1,181 @@
+import hashlib
+import uuid
+from collections import defaultdict
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+PERMISSIONS = ("read", "write", "delete")
+ADMIN_PERMISSIONS = PERMISSIONS + ("share",)
+
+
+class PermissionCache:
+    """
+    Shared cache of effective permission bits keyed by user and file.
+
+    Every key embeds version tokens of the user and of the file and each of
+    its ancestors, so bumping one token invalidates every answer that depends
+    on it, in all processes, without enumerating the stale entries.
+    """
+    prefix = "drive:acl"
+
+    @property
+    def timeout(self):
+        return getattr(settings, "DRIVE_PERMISSION_CACHE_TIMEOUT", 300)
+
+    def version_key(self, scope, pk):
+        return "%s:v:%s:%s" % (self.prefix, scope, pk)
+
+    def get_versions(self, keys):
+        versions = cache.get_many(keys)
+        missing = {key: uuid.uuid4().hex for key in keys if key not in versions}
+        if missing:
+            cache.set_many(missing, None)
+            versions.update(missing)
+        return versions
+
+    def bump(self, scope, pks):
+        tokens = {self.version_key(scope, pk): uuid.uuid4().hex for pk in pks}
+        if tokens:
+            transaction.on_commit(lambda: cache.set_many(tokens, None))
+
+    def bump_files(self, *pks):
+        self.bump("file", [getattr(pk, "hex", pk) for pk in pks])
+
+    def bump_user(self, pk):
+        self.bump("user", [pk])
+
+    def get_keys(self, user, files):
+        scopes = {file.pk: file.get_ancestor_ids() + [file.pk.hex] for file in files}
+        keys = {self.version_key("user", user.pk)}
+        for ids in scopes.values():
+            keys.update(self.version_key("file", pk) for pk in ids)
+        versions = self.get_versions(list(keys))
+
+        user_version = versions[self.version_key("user", user.pk)]
+        result = {}
+        for pk, ids in scopes.items():
+            tokens = [user_version] + [versions[self.version_key("file", id)] for id in ids]
+            digest = hashlib.md5(":".join(tokens).encode()).hexdigest()
+            result[pk] = "%s:p:%s:%s:%s" % (self.prefix, user.pk, pk.hex, digest)
+        return result
+
+    def get_many(self, keys):
+        return cache.get_many(list(keys))
+
+    def set_many(self, entries):
+        cache.set_many(entries, self.timeout)
+
+
+permission_cache = PermissionCache()
+
+
+class PermissionResolver:
+    """
+    Resolve the permissions of one user on many files with a constant number
+    of queries, including the grants inherited from their ancestors.
+
+    Answers are kept for the lifetime of the resolver, which is attached to
+    the user object of a single request.
+    """
+
+    def __init__(self, user):
+        self.user = user
+        self._groups = None
+        self._permissions = {}
+
+    def get_groups(self):
+        """
+        Map of the ids of the user's groups to whether the user administers them
+        """
+        if self._groups is None:
+            UserGroup = apps.get_model("drive", "UserGroup")
+            memberships = UserGroup.objects.filter(user=self.user)
+            self._groups = dict(memberships.values_list("group_id", "is_admin"))
+        return self._groups
+
+    def is_group_member(self, group):
+        return getattr(group, "pk", group) in self.get_groups()
+
+    def is_group_admin(self, group):
+        return self.get_groups().get(getattr(group, "pk", group), False)
+
+    def _grants(self, model, **kwargs):
+        grants = defaultdict(set)
+        rows = model.objects.filter(**kwargs).values_list("file_id", "can_read", "can_write", "can_delete")
+        for file_id, *flags in rows:
+            grants[file_id].update(
+                permission for permission, allowed in zip(PERMISSIONS, flags) if allowed
+            )
+        return grants
+
+    def _resolve(self, file, user_grants, group_grants):
+        groups = self.get_groups()
+        if file.author_id == self.user.pk or groups.get(file.group_id, False):
+            return set(ADMIN_PERMISSIONS)
+
+        granted = set()
+        if file.group_id in groups:
+            granted.update(
+                permission for permission in PERMISSIONS if getattr(file, "can_%s" % permission)
+            )
+        # Grants on any ancestor apply to the whole subtree below it
+        for pk in self._path_ids(file):
+            granted |= user_grants[pk]
+            granted |= group_grants[pk]
+        return granted
+
+    def _path_ids(self, file):
+        return [uuid.UUID(pk) for pk in file.get_path_ids()]
+
+    def prime(self, files):
+        """
+        Resolve the permissions of every file not resolved yet, from the
+        shared cache when possible and from the database otherwise
+        """
+        files = [file for file in files if file.pk not in self._permissions]
+        if not files:
+            return
+        keys = permission_cache.get_keys(self.user, files)
+        cached = permission_cache.get_many(keys.values())
+
+        missing = []
+        for file in files:
+            key = keys[file.pk]
+            if key in cached:
+                self._permissions[file.pk] = set(cached[key])
+            else:
+                missing.append(file)
+        if missing:
+            self.compute(missing)
+            permission_cache.set_many({
+                keys[file.pk]: tuple(self._permissions[file.pk]) for file in missing
+            })
+
+    def compute(self, files):
+        ids = list({pk for file in files for pk in self._path_ids(file)})
+        groups = self.get_groups()
+
+        UserFile = apps.get_model("drive", "UserFile")
+        GroupFile = apps.get_model("drive", "GroupFile")
+        user_grants = self._grants(UserFile, user=self.user, file_id__in=ids)
+        group_grants = defaultdict(set)
+        if groups:
+            group_grants = self._grants(GroupFile, group_id__in=list(groups), file_id__in=ids)
+
+        for file in files:
+            self._permissions[file.pk] = self._resolve(file, user_grants, group_grants)
+
+    def get_permissions(self, file):
+        if file.pk not in self._permissions:
+            self.prime([file])
+        return self._permissions[file.pk]
+
+    def has_permission(self, file, permission):
+        return permission in self.get_permissions(file)
+
+    def clear(self):
+        self._groups = None
+        self._permissions = {}
@@ -0,0 +1,174 @@
+from celery import shared_task
+from celery.utils.log import get_task_logger
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from .models import Blob, BlobReclaim, File, UserStorage
+from .orphans import OrphanCollector
+from .progress import trash_progress
+
+logger = get_task_logger(__name__)
+
+TRASH_BATCH_SIZE = 500
+TRASH_BATCHES_PER_RUN = 20
+
+
+RECLAIM_BATCH_SIZE = 500
+RECLAIM_PENDING_KEY = "drive:reclaim:pending"
+RECLAIM_PENDING_TIMEOUT = 5 * 60
+
+ORPHAN_SCAN_LIMIT = 50000
+
+USAGE_BATCH_SIZE = 1000
+USAGE_BATCHES_PER_RUN = 50
+
+
+def schedule_reclaim():
+    """
+    Run reclaim_blobs once the current transaction commits
+    """
+    transaction.on_commit(enqueue_reclaim)
+
+
+def enqueue_reclaim():
+    # Skipped while a run is pending, so a transaction deleting many files, or
+    # several committing at once, enqueue it only once. The mark expires so a
+    # lost task cannot hold back later reclaims.
+    if cache.add(RECLAIM_PENDING_KEY, True, RECLAIM_PENDING_TIMEOUT):
+        reclaim_blobs.delay()
+
+
+@shared_task()
+def reclaim_blobs(batch_size=RECLAIM_BATCH_SIZE):
+    """
+    Delete the blobs queued by committed file deletions, a batch at a time.
+    Failures are retried by later runs up to BlobReclaim.MAX_ATTEMPTS.
+
+    The blob rows of the batch stay locked while their content is deleted, so
+    an upload of identical content either waits for the blob to be removed or
+    references it first, in which case it is kept.
+    """
+    # Reclaims committed from here on enqueue another run
+    cache.delete(RECLAIM_PENDING_KEY)
+    pending = (
+        BlobReclaim.objects.filter(attempts__lt=BlobReclaim.MAX_ATTEMPTS)
+        .order_by("attempts", "created")
+        .select_for_update(skip_locked=True)
+    )
+    reclaimed, failed, released = [], [], []
+    with transaction.atomic():
+        # Rows claimed by a concurrent run stay locked until it commits and
+        # are skipped instead of being reclaimed twice
+        reclaims = list(pending[:batch_size])
+        blobs = Blob.objects.select_for_update().filter(name__in=[reclaim.name for reclaim in reclaims])
+        blobs = {blob.name: blob for blob in blobs}
+        for reclaim in reclaims:
+            blob = blobs.get(reclaim.name)
+            if blob is not None and blob.ref_count > 0:
+                reclaimed.append(reclaim.pk)
+                continue
+            try:
+                default_storage.delete(reclaim.name)
+            except OSError as error:
+                logger.warning("Could not delete blob %s: %s", reclaim.name, error)
+                failed.append(reclaim.pk)
+            else:
+                reclaimed.append(reclaim.pk)
+                if blob is not None:
+                    released.append(blob.pk)
+
+        Blob.objects.filter(pk__in=released).delete()
+        BlobReclaim.objects.filter(pk__in=reclaimed).delete()
+        BlobReclaim.objects.filter(pk__in=failed).update(attempts=F("attempts") + 1)
+    if len(reclaims) == batch_size and reclaimed:
+        reclaim_blobs.delay(batch_size)
+    return len(reclaimed)
+
+
+@shared_task()
+def empty_trash(user_id, total=None, deleted=0):
+    """
+    Permanently delete the trash of a user, deepest files first, in batches
+    that each commit on their own. Runs that hit the batch limit re-enqueue
+    themselves so no single run outlives the task time limit.
+    """
+    user = get_user_model().objects.get(pk=user_id)
+    subtree = File.objects.get_trash_subtree(user).values_list("pk", flat=True)
+    if total is None:
+        total = subtree.count()
+
+    try:
+        for _ in range(TRASH_BATCHES_PER_RUN):
+            with transaction.atomic():
+                batch = list(subtree[:TRASH_BATCH_SIZE])
+                if batch:
+                    deleted += File.objects.purge(batch)
+                    schedule_reclaim()
+            if not batch:
+                trash_progress.finish(user_id, total, deleted)
+                return deleted
+            trash_progress.update(user_id, total, deleted)
+    except Exception:
+        trash_progress.fail(user_id, total, deleted)
+        raise
+
+    empty_trash.delay(user_id, total, deleted)
+    return deleted
+
+
+@shared_task()
+def collect_orphans(delete=False, after=None, found=0, deleted=0):
+    """
+    Report, and optionally delete, stored blobs no file references. Each run
+    scans at most ORPHAN_SCAN_LIMIT blobs and re-enqueues itself from the last
+    one until the whole listing has been merged.
+    """
+    collector = OrphanCollector(delete=delete)
+    scan = collector.collect(after=after, limit=ORPHAN_SCAN_LIMIT)
+    found += scan.found
+    deleted += scan.deleted
+
+    if scan.last is not None:
+        collect_orphans.delay(delete, scan.last, found, deleted)
+    else:
+        logger.info("Orphan collection done: %s orphans found, %s deleted", found, deleted)
+    return scan.scanned
+
+
+@shared_task()
+def reconcile_usage(after=None, batch_size=USAGE_BATCH_SIZE):
+    """
+    Recompute bytes_used of every storage from the sizes of the files its user
+    authored, trashed ones included, correcting any drift of the charges made
+    on upload and the credits made on delete. Each batch is one aggregate
+    update committing on its own; runs re-enqueue themselves from the last
+    storage they reached.
+    """
+    usage = (
+        File.all_objects.filter(author=OuterRef("user"))
+        .order_by()
+        .values("author")
+        .annotate(bytes=Sum("size_bytes"))
+        .values("bytes")
+    )
+    storages = UserStorage.objects.order_by("pk").values_list("pk", flat=True)
+    if after is not None:
+        storages = storages.filter(pk__gt=after)
+
+    updated = 0
+    for _ in range(USAGE_BATCHES_PER_RUN):
+        batch = list(storages[:batch_size])
+        if not batch:
+            return updated
+        with transaction.atomic():
+            updated += UserStorage.objects.filter(pk__in=batch).update(
+                bytes_used=Coalesce(Subquery(usage), Value(0))
+            )
+        storages = storages.filter(pk__gt=batch[-1])
+
+    reconcile_usage.delay(batch[-1].hex, batch_size)
+    return updated
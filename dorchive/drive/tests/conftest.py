@@ -0,0 +1,23 @@
+import pytest
+from django.core.cache import cache
+from django.core.management import call_command
+
+from dorchive.drive.registry import filetypes
+
+
+@pytest.fixture()
+def locmem_cache(settings):
+    settings.CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": "drive-tests",
+        },
+    }
+    cache.clear()
+
+
+@pytest.fixture()
+def file_types(db, monkeypatch):
+    call_command("loaddata", "filetype", verbosity=0)
+    # Reloaded from the fixture, and put back once the test is rolled back
+    monkeypatch.setattr(filetypes, "_maps", None)
@@ -0,0 +1,37 @@
+from factory import Sequence
+from factory import SelfAttribute
+from factory import SubFactory
+from factory.django import DjangoModelFactory
+from factory.django import FileField
+
+from dorchive.drive.models import Document
+from dorchive.drive.models import Folder
+from dorchive.drive.models import Group
+from dorchive.users.tests.factories import UserFactory
+
+
+class FolderFactory(DjangoModelFactory):
+    name = Sequence(lambda n: f"Folder {n}")
+    author = SubFactory(UserFactory)
+    modified_by = SelfAttribute("author")
+
+    class Meta:
+        model = Folder
+
+
+class DocumentFactory(DjangoModelFactory):
+    name = Sequence(lambda n: f"document-{n}.txt")
+    original_filename = SelfAttribute("name")
+    file = FileField(filename="document.txt", data=b"content")
+    author = SubFactory(UserFactory)
+    modified_by = SelfAttribute("author")
+
+    class Meta:
+        model = Document
+
+
+class GroupFactory(DjangoModelFactory):
+    name = Sequence(lambda n: f"Group {n}")
+
+    class Meta:
+        model = Group
@@ -0,0 +1,442 @@
+import pytest
+from django.core.files.storage import default_storage
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from dorchive.drive.exceptions import InvalidMoveError
+from dorchive.drive.exceptions import QuotaExceededError
+from dorchive.drive.models import Blob
+from dorchive.drive.models import BlobReclaim
+from dorchive.drive.models import File
+from dorchive.drive.models import UserStorage
+from dorchive.drive.modifications import modifications
+from dorchive.drive.tasks import empty_trash
+from dorchive.drive.tests.factories import DocumentFactory
+from dorchive.drive.tests.factories import FolderFactory
+from dorchive.drive.tests.factories import GroupFactory
+from dorchive.users.tests.factories import UserFactory
+
+pytestmark = pytest.mark.django_db
+
+
+def counters(file):
+    file.refresh_from_db()
+    return file.total_bytes, file.total_files, file.child_count
+
+
+class TestTrash:
+    def test_delete_trashes_subtree(self, user):
+        folder = FolderFactory(author=user)
+        subfolder = FolderFactory(author=user, parent=folder)
+        document = DocumentFactory(author=user, parent=subfolder)
+
+        folder.delete()
+
+        trashed = File.all_objects.filter(trash_root=folder.pk, is_removed=True)
+        assert set(trashed.values_list("pk", flat=True)) == {folder.pk, subfolder.pk, document.pk}
+        assert list(File.get_trash(user)) == [folder]
+
+    def test_delete_withdraws_counters(self, user):
+        root = FolderFactory(author=user)
+        folder = FolderFactory(author=user, parent=root)
+        DocumentFactory(author=user, parent=folder, file__data=b"12345")
+        DocumentFactory(author=user, parent=root, file__data=b"123")
+        assert counters(root) == (8, 2, 2)
+
+        folder.delete()
+
+        assert counters(root) == (3, 1, 1)
+        assert counters(folder) == (5, 1, 1)
+
+    def test_restore_adds_counters_back(self, user):
+        root = FolderFactory(author=user)
+        folder = FolderFactory(author=user, parent=root)
+        DocumentFactory(author=user, parent=folder, file__data=b"12345")
+        folder.delete()
+
+        folder.restore()
+
+        assert not folder.is_removed
+        assert folder.trash_root is None
+        assert counters(root) == (5, 1, 1)
+        assert not File.all_objects.filter(path__startswith=folder.path, is_removed=True).exists()
+
+    def test_restore_file_trashed_with_folder_restores_folder(self, user):
+        root = FolderFactory(author=user)
+        folder = FolderFactory(author=user, parent=root)
+        document = DocumentFactory(author=user, parent=folder, file__data=b"12345")
+        folder.delete()
+        document.refresh_from_db()
+
+        document.restore()
+
+        folder.refresh_from_db()
+        assert not document.is_removed
+        assert document.parent_id == folder.pk
+        assert not folder.is_removed
+        assert counters(root) == (5, 1, 1)
+        assert not File.get_trash(user).exists()
+
+    def test_restore_under_trashed_folder_moves_to_top_level(self, user):
+        folder = FolderFactory(author=user)
+        document = DocumentFactory(author=user, parent=folder)
+        document.delete()
+        folder.delete()
+
+        document.restore()
+
+        assert not document.is_removed
+        assert document.parent is None
+        assert document.depth == 0
+        folder.refresh_from_db()
+        assert folder.is_removed
+
+    def test_restore_renames_when_name_taken(self, user):
+        document = DocumentFactory(author=user, name="report.txt")
+        document.delete()
+        DocumentFactory(author=user, name="report.txt")
+
+        document.restore()
+
+        assert document.name == "report (1).txt"
+
+    def test_restore_roots_skips_non_roots(self, user):
+        folder = FolderFactory(author=user)
+        document = DocumentFactory(author=user, parent=folder)
+        folder.delete()
+        document.refresh_from_db()
+
+        assert File.objects.restore_roots([document]) == 0
+        assert File.all_objects.filter(trash_root=folder.pk, is_removed=True).count() == 2
+
+
+class TestUserStorage:
+    def test_reserve_usage_charges_bytes(self, user):
+        user.storage.reserve_usage(100)
+
+        user.storage.refresh_from_db()
+        assert user.storage.bytes_used == 100
+
+    def test_reserve_usage_up_to_quota(self, user):
+        UserStorage.objects.filter(user=user).update(bytes_used=90, bytes_total=100)
+
+        user.storage.reserve_usage(10)
+
+        user.storage.refresh_from_db()
+        assert user.storage.bytes_used == 100
+
+    def test_reserve_usage_over_quota_raises(self, user):
+        UserStorage.objects.filter(user=user).update(bytes_used=90, bytes_total=100)
+
+        with pytest.raises(QuotaExceededError):
+            user.storage.reserve_usage(11)
+
+        user.storage.refresh_from_db()
+        assert user.storage.bytes_used == 90
+
+    def test_release_usage_never_below_zero(self, user):
+        UserStorage.objects.filter(user=user).update(bytes_used=5)
+
+        UserStorage.release_usage({user.pk: 8})
+
+        user.storage.refresh_from_db()
+        assert user.storage.bytes_used == 0
+
+    def test_permanent_delete_credits_author(self, user):
+        document = DocumentFactory(author=user, file__data=b"12345")
+        UserStorage.objects.filter(user=user).update(bytes_used=12)
+
+        document.permanent_delete()
+
+        user.storage.refresh_from_db()
+        assert user.storage.bytes_used == 7
+
+    def test_trash_keeps_usage(self, user):
+        document = DocumentFactory(author=user, file__data=b"12345")
+        UserStorage.objects.filter(user=user).update(bytes_used=5)
+
+        document.delete()
+
+        user.storage.refresh_from_db()
+        assert user.storage.bytes_used == 5
+
+
+class TestBlob:
+    def test_identical_content_shares_blob(self, user):
+        first = DocumentFactory(author=user, file__data=b"same content")
+        second = DocumentFactory(author=user, file__data=b"same content")
+
+        blob = Blob.objects.get()
+        assert first.file.name == second.file.name == blob.name
+        assert blob.ref_count == 2
+        assert default_storage.exists(blob.name)
+
+    def test_different_content_gets_own_blob(self, user):
+        DocumentFactory(author=user, file__data=b"one")
+        DocumentFactory(author=user, file__data=b"two")
+
+        assert list(Blob.objects.values_list("ref_count", flat=True)) == [1, 1]
+
+    def test_delete_keeps_shared_blob(self, user):
+        first = DocumentFactory(author=user, file__data=b"same content")
+        DocumentFactory(author=user, file__data=b"same content")
+
+        first.permanent_delete()
+
+        assert Blob.objects.get().ref_count == 1
+        assert not BlobReclaim.objects.exists()
+
+    def test_delete_of_last_reference_queues_reclaim(self, user):
+        document = DocumentFactory(author=user, file__data=b"content")
+        name = document.file.name
+
+        document.permanent_delete()
+
+        assert Blob.objects.get().ref_count == 0
+        assert list(BlobReclaim.objects.values_list("name", flat=True)) == [name]
+
+    def test_trash_keeps_reference(self, user):
+        document = DocumentFactory(author=user, file__data=b"content")
+
+        document.delete()
+
+        assert Blob.objects.get().ref_count == 1
+        assert not BlobReclaim.objects.exists()
+
+
+class TestModifications:
+    def test_touch_updates_ancestors_in_one_query(self, user, django_assert_num_queries):
+        root = FolderFactory(author=user)
+        folder = FolderFactory(author=user, parent=root)
+        document = DocumentFactory(author=user, parent=folder)
+        uploader = UserFactory()
+
+        with django_assert_num_queries(1):
+            modifications.touch(document.get_ancestor_ids(), uploader)
+
+        assert File.objects.filter(pk__in=[root.pk, folder.pk], modified_by=uploader).count() == 2
+
+    def test_coalesce_updates_each_ancestor_once(self, user):
+        root = FolderFactory(author=user)
+        folder = FolderFactory(author=user, parent=root)
+        uploader = UserFactory()
+        modified = root.modified
+
+        with CaptureQueriesContext(connection) as queries:
+            with modifications.coalesce():
+                for _ in range(5):
+                    DocumentFactory(author=uploader, parent=folder).touch(uploader)
+                root.refresh_from_db()
+                assert root.modified == modified
+                uploaded = len(queries)
+                flushed = timezone.now()
+
+        assert len(queries) == uploaded + 1
+        assert queries[-1]["sql"].startswith("UPDATE")
+        assert "modified_by" in queries[-1]["sql"]
+        root.refresh_from_db()
+        folder.refresh_from_db()
+        assert root.modified == folder.modified
+        assert root.modified >= flushed
+        assert root.modified_by == folder.modified_by == uploader
+
+
+class TestPath:
+    def assert_path(self, file, *ancestors):
+        file.refresh_from_db()
+        assert file.path == "".join(f"{ancestor.pk.hex}/" for ancestor in (*ancestors, file))
+        assert file.depth == len(ancestors)
+
+    def test_path_follows_parents(self, user):
+        root = FolderFactory(author=user)
+        folder = FolderFactory(author=user, parent=root)
+        document = DocumentFactory(author=user, parent=folder)
+
+        self.assert_path(root)
+        self.assert_path(folder, root)
+        self.assert_path(document, root, folder)
+
+    def test_move_deeper_rewrites_descendants(self, user):
+        root = FolderFactory(author=user)
+        folder = FolderFactory(author=user, parent=root)
+        subfolder = FolderFactory(author=user, parent=folder)
+        document = DocumentFactory(author=user, parent=subfolder)
+        other = FolderFactory(author=user)
+        destination = FolderFactory(author=user, parent=other)
+
+        folder.move(destination)
+
+        self.assert_path(folder, other, destination)
+        self.assert_path(subfolder, other, destination, folder)
+        self.assert_path(document, other, destination, folder, subfolder)
+        self.assert_path(root)
+
+    def test_move_to_top_level_rewrites_descendants(self, user):
+        root = FolderFactory(author=user)
+        folder = FolderFactory(author=user, parent=root)
+        subfolder = FolderFactory(author=user, parent=folder)
+        document = DocumentFactory(author=user, parent=subfolder)
+
+        subfolder.move(None)
+
+        self.assert_path(subfolder)
+        self.assert_path(document, subfolder)
+        self.assert_path(folder, root)
+
+    def test_move_keeps_trashed_descendants(self, user):
+        folder = FolderFactory(author=user)
+        document = DocumentFactory(author=user, parent=folder)
+        document.delete()
+        destination = FolderFactory(author=user)
+
+        folder.move(destination)
+
+        self.assert_path(document, destination, folder)
+
+    def test_move_into_descendant_is_refused(self, user):
+        folder = FolderFactory(author=user)
+        subfolder = FolderFactory(author=user, parent=folder)
+
+        with pytest.raises(InvalidMoveError):
+            folder.move(subfolder)
+        with pytest.raises(InvalidMoveError):
+            folder.move(folder)
+
+        self.assert_path(subfolder, folder)
+
+
+class TestRollup:
+    def totals(self, *files):
+        for file in files:
+            file.refresh_from_db()
+        return [(file.total_bytes, file.total_files) for file in files]
+
+    def test_totals_through_file_lifecycle(self, user):
+        root = FolderFactory(author=user)
+        folder = FolderFactory(author=user, parent=root)
+        other = FolderFactory(author=user)
+
+        document = DocumentFactory(author=user, parent=folder, file__data=b"12345")
+        DocumentFactory(author=user, parent=root, file__data=b"123")
+        assert self.totals(root, folder, other) == [(8, 2), (5, 1), (0, 0)]
+
+        folder.move(other)
+        assert self.totals(root, folder, other) == [(3, 1), (5, 1), (5, 1)]
+
+        document.refresh_from_db()
+        document.delete()
+        assert self.totals(root, folder, other) == [(3, 1), (0, 0), (0, 0)]
+
+        document.restore()
+        assert self.totals(root, folder, other) == [(3, 1), (5, 1), (5, 1)]
+
+        folder.delete()
+        assert self.totals(root, other) == [(3, 1), (0, 0)]
+
+        empty_trash(user.pk)
+        assert self.totals(root, other) == [(3, 1), (0, 0)]
+
+    def test_permanent_delete_withdraws_totals(self, user):
+        root = FolderFactory(author=user)
+        folder = FolderFactory(author=user, parent=root)
+        document = DocumentFactory(author=user, parent=folder, file__data=b"12345")
+
+        document.permanent_delete()
+
+        assert self.totals(root, folder) == [(0, 0), (0, 0)]
+
+    def test_trashed_folder_keeps_totals_of_its_subtree(self, user):
+        root = FolderFactory(author=user)
+        folder = FolderFactory(author=user, parent=root)
+        subfolder = FolderFactory(author=user, parent=folder)
+        document = DocumentFactory(author=user, parent=subfolder, file__data=b"12345")
+        folder.delete()
+
+        document.permanent_delete()
+
+        assert self.totals(root, folder, subfolder) == [(0, 0), (5, 1), (0, 0)]
+
+
+class TestChildCount:
+    def child_counts(self, *files):
+        for file in files:
+            file.refresh_from_db()
+        return [file.child_count for file in files]
+
+    def test_child_count_through_file_lifecycle(self, user):
+        root = FolderFactory(author=user)
+        folder = FolderFactory(author=user, parent=root)
+        other = FolderFactory(author=user)
+
+        document = DocumentFactory(author=user, parent=folder)
+        DocumentFactory(author=user, parent=folder)
+        assert self.child_counts(root, folder, other) == [1, 2, 0]
+
+        folder.move(other)
+        assert self.child_counts(root, folder, other) == [0, 2, 1]
+
+        document.refresh_from_db()
+        document.delete()
+        assert self.child_counts(root, folder, other) == [0, 1, 1]
+        assert folder.child_count == File.objects.count_children(folder)
+
+        document.restore()
+        assert self.child_counts(root, folder, other) == [0, 2, 1]
+
+        folder.delete()
+        assert self.child_counts(other) == [0]
+
+        folder.restore()
+        assert self.child_counts(folder, other) == [2, 1]
+
+        folder.delete()
+        empty_trash(user.pk)
+        assert self.child_counts(root, other) == [0, 0]
+
+
+class TestInheritedSharing:
+    @pytest.fixture()
+    def tree(self, user):
+        folder = FolderFactory(author=user)
+        subfolder = FolderFactory(author=user, parent=folder)
+        document = DocumentFactory(author=user, parent=subfolder)
+        return folder, subfolder, document
+
+    def test_folder_grant_reaches_grandchild(self, user, tree, locmem_cache):
+        folder, subfolder, document = tree
+        recipient = UserFactory()
+        group = GroupFactory()
+        member = UserFactory()
+        group.add_member(member)
+        permissions = {"can_read": True, "can_write": False, "can_delete": False}
+
+        folder.add_person(recipient, permissions=permissions)
+        folder.add_group(group, permissions=permissions)
+
+        for reader in (recipient, member):
+            assert reader.can_read(document)
+            assert not reader.can_write(document)
+        assert not UserFactory().can_read(document)
+        assert document.is_shared_with_person(recipient)
+        assert document.is_shared_with_group(group)
+        assert document.get_shared_parent(user=recipient) == folder
+
+    def test_inherited_recipients_are_not_share_candidates(self, user, tree):
+        folder, subfolder, document = tree
+        recipient = UserFactory()
+        other = UserFactory()
+        group = GroupFactory()
+        other_group = GroupFactory()
+        permissions = {"can_read": True, "can_write": False, "can_delete": False}
+
+        folder.add_person(recipient, permissions=permissions)
+        folder.add_group(group, permissions=permissions)
+
+        assert recipient not in document.get_non_shared_people()
+        assert other in document.get_non_shared_people()
+        assert list(document.get_non_shared_groups()) == [other_group]
+        assert list(document.get_shared_people()) == [recipient]
+        assert list(document.get_shared_groups()) == [group]
+        assert recipient in folder.get_shared_people()
+        assert not FolderFactory(author=user).get_shared_people().exists()
@@ -0,0 +1,79 @@
+from datetime import timedelta
+
+import pytest
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+from dorchive.drive.hooks import UPLOAD_DIR
+from dorchive.drive.models import Blob
+from dorchive.drive.models import BlobReclaim
+from dorchive.drive.orphans import OrphanCollector
+from dorchive.drive.tests.factories import DocumentFactory
+
+pytestmark = pytest.mark.django_db
+
+# Byte order puts upper case, then "_", then lower case, unlike most locales
+FILES = ["aa/B", "aa/_x", "ab/Zeta", "ab/alpha"]
+BLOBS = ["aa/C_", "aa/a", "ab/_"]
+RECLAIMS = ["aa/Ab", "ab/b"]
+ORPHANS = ["aa/M", "aa/b", "ab/Z", "ab/z"]
+
+
+def blob_name(name):
+    return f"{UPLOAD_DIR}/{name}"
+
+
+@pytest.fixture()
+def stored(user):
+    for name in FILES + BLOBS + RECLAIMS + ORPHANS:
+        default_storage.save(blob_name(name), ContentFile(b"content"))
+    for name in FILES:
+        DocumentFactory(author=user, file=blob_name(name))
+    for n, name in enumerate(BLOBS):
+        Blob.objects.create(digest=str(n), name=blob_name(name), size=7, ref_count=1)
+    for name in RECLAIMS:
+        BlobReclaim.objects.create(name=blob_name(name))
+
+
+def collect(**kwargs):
+    found = []
+    collector = OrphanCollector(grace=timedelta(0), batch_size=1, **kwargs)
+    scan = collector.collect(callback=lambda name, deleted: found.append(name))
+    return scan, found
+
+
+def test_reports_only_unreferenced_blobs(stored):
+    scan, found = collect()
+
+    assert found == [blob_name(name) for name in ORPHANS]
+    assert scan.scanned == len(FILES + BLOBS + RECLAIMS + ORPHANS)
+    assert scan.deleted == 0
+    assert all(default_storage.exists(name) for name in found)
+
+
+def test_deletes_only_unreferenced_blobs(stored):
+    scan, found = collect(delete=True)
+
+    assert scan.deleted == len(ORPHANS)
+    assert not any(default_storage.exists(name) for name in found)
+    for name in FILES + BLOBS + RECLAIMS:
+        assert default_storage.exists(blob_name(name))
+
+
+def test_resumes_after_last_name(stored):
+    collector = OrphanCollector(grace=timedelta(0), batch_size=1)
+    found = []
+    last = None
+    while True:
+        scan = collector.collect(after=last, limit=3, callback=lambda name, deleted: found.append(name))
+        if scan.last is None:
+            break
+        last = scan.last
+
+    assert found == [blob_name(name) for name in ORPHANS]
+
+
+def test_keeps_blobs_within_grace_period(stored):
+    collector = OrphanCollector(grace=timedelta(hours=1))
+
+    assert collector.collect().found == 0
@@ -0,0 +1,48 @@
+import pytest
+
+from dorchive.drive.models import FileType
+from dorchive.drive.registry import FileTypeRegistry
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture()
+def registry(monkeypatch, locmem_cache):
+    registry = FileTypeRegistry()
+    monkeypatch.setattr("dorchive.drive.receivers.filetypes", registry)
+    return registry
+
+
+def test_classify_by_extension(registry):
+    markdown = FileType.objects.create(name="Markdown", extension="md", icon="icon/text.png")
+
+    assert registry.classify("README.MD") == markdown
+    assert registry.get(markdown.pk) == markdown
+
+
+def test_change_is_seen_once_committed(registry, django_capture_on_commit_callbacks):
+    registry.load()
+
+    with django_capture_on_commit_callbacks(execute=True):
+        markdown = FileType.objects.create(name="Markdown", extension="md", icon="icon/text.png")
+        assert registry.get_by_extension("md") is None
+
+    assert registry.get_by_extension("md") == markdown
+
+
+def test_bump_swaps_maps_in_place_of_clearing(registry, monkeypatch):
+    registry.load()
+    maps = registry._maps
+    seen = []
+    load = registry.load
+
+    def reload():
+        seen.append(registry._maps)
+        load()
+
+    monkeypatch.setattr(registry, "load", reload)
+    registry._bump()
+
+    assert seen == [maps]
+    assert registry._maps is not maps
+    assert registry._maps.by_extension == {}
@@ -0,0 +1,185 @@
+import pytest
+
+from dorchive.drive.resolvers import ADMIN_PERMISSIONS
+from dorchive.drive.resolvers import PermissionResolver
+from dorchive.drive.tests.factories import DocumentFactory
+from dorchive.drive.tests.factories import FolderFactory
+from dorchive.drive.tests.factories import GroupFactory
+from dorchive.users.tests.factories import UserFactory
+
+pytestmark = pytest.mark.django_db
+
+READ_ONLY = {"can_read": True, "can_write": False, "can_delete": False}
+
+
+def permissions(user, file):
+    return PermissionResolver(user).get_permissions(file)
+
+
+class TestPermissionResolver:
+    def test_author_has_every_permission(self, user, locmem_cache):
+        document = DocumentFactory(author=user)
+
+        assert permissions(user, document) == set(ADMIN_PERMISSIONS)
+
+    def test_stranger_has_no_permission(self, user, locmem_cache):
+        document = DocumentFactory(author=user)
+
+        assert permissions(UserFactory(), document) == set()
+
+    def test_group_member_gets_file_flags(self, user, locmem_cache):
+        group = GroupFactory()
+        group.add_member(user)
+        document = DocumentFactory(group=group, can_write=False)
+
+        assert permissions(user, document) == {"read"}
+
+    def test_group_admin_has_every_permission(self, user, locmem_cache):
+        group = GroupFactory()
+        group.add_member(user)
+        group.set_admin(user)
+        document = DocumentFactory(group=group, can_write=False)
+
+        assert permissions(user, document) == set(ADMIN_PERMISSIONS)
+
+    def test_user_grant_is_inherited(self, user, locmem_cache):
+        folder = FolderFactory()
+        subfolder = FolderFactory(author=folder.author, parent=folder)
+        document = DocumentFactory(author=folder.author, parent=subfolder)
+        subfolder.add_person(user, permissions=READ_ONLY)
+
+        assert permissions(user, document) == {"read"}
+        assert permissions(user, subfolder) == {"read"}
+        assert permissions(user, folder) == set()
+
+    def test_group_grant_reaches_members(self, user, locmem_cache):
+        group = GroupFactory()
+        group.add_member(user)
+        folder = FolderFactory()
+        document = DocumentFactory(author=folder.author, parent=folder)
+        folder.add_group(group, permissions={"can_read": True, "can_write": True, "can_delete": True})
+
+        assert permissions(user, document) == {"read", "write", "delete"}
+        assert permissions(UserFactory(), document) == set()
+
+    def test_grants_add_up(self, user, locmem_cache):
+        group = GroupFactory()
+        group.add_member(user)
+        folder = FolderFactory()
+        document = DocumentFactory(author=folder.author, parent=folder)
+        folder.add_group(group, permissions=READ_ONLY)
+        document.add_person(user, permissions={"can_read": False, "can_write": True, "can_delete": False})
+
+        assert permissions(user, document) == {"read", "write"}
+
+    def test_prime_resolves_listing_in_constant_queries(self, user, locmem_cache, django_assert_num_queries):
+        group = GroupFactory()
+        group.add_member(user)
+        files = []
+        for _ in range(5):
+            folder = FolderFactory()
+            folder.add_group(group, permissions=READ_ONLY)
+            subfolder = FolderFactory(author=folder.author, parent=folder)
+            files += DocumentFactory.create_batch(2, author=folder.author, parent=subfolder)
+        files += DocumentFactory.create_batch(3, author=user)
+
+        resolver = PermissionResolver(user)
+        # The user's groups, then the user and group grants on every path
+        with django_assert_num_queries(3):
+            resolver.prime(files)
+            for file in files:
+                resolver.get_permissions(file)
+
+        assert all(resolver.has_permission(file, "read") for file in files)
+        assert [resolver.has_permission(file, "share") for file in files] == [False] * 10 + [True] * 3
+
+    def test_prime_is_served_from_shared_cache(self, user, locmem_cache, django_assert_num_queries):
+        folder = FolderFactory()
+        folder.add_person(user, permissions=READ_ONLY)
+        files = DocumentFactory.create_batch(5, author=folder.author, parent=folder)
+        PermissionResolver(user).prime(files)
+
+        resolver = PermissionResolver(user)
+        with django_assert_num_queries(0):
+            resolver.prime(files)
+
+        assert all(resolver.get_permissions(file) == {"read"} for file in files)
+
+
+class TestPermissionCache:
+    """
+    Decisions are cached across requests until a change they depend on
+    commits
+    """
+
+    def cached_permissions(self, user, file, django_assert_num_queries):
+        file.refresh_from_db()
+        PermissionResolver(user).prime([file])
+        with django_assert_num_queries(0):
+            return PermissionResolver(user).get_permissions(file)
+
+    def test_grant_change_invalidates(
+        self, user, locmem_cache, django_assert_num_queries, django_capture_on_commit_callbacks,
+    ):
+        folder = FolderFactory()
+        document = DocumentFactory(author=folder.author, parent=folder)
+        assert self.cached_permissions(user, document, django_assert_num_queries) == set()
+
+        with django_capture_on_commit_callbacks(execute=True):
+            folder.add_person(user, permissions=READ_ONLY)
+
+        assert permissions(user, document) == {"read"}
+
+        with django_capture_on_commit_callbacks(execute=True):
+            folder.remove_person(user)
+
+        assert permissions(user, document) == set()
+
+    def test_membership_change_invalidates(
+        self, user, locmem_cache, django_assert_num_queries, django_capture_on_commit_callbacks,
+    ):
+        group = GroupFactory()
+        folder = FolderFactory()
+        document = DocumentFactory(author=folder.author, parent=folder)
+        folder.add_group(group, permissions=READ_ONLY)
+        assert self.cached_permissions(user, document, django_assert_num_queries) == set()
+
+        with django_capture_on_commit_callbacks(execute=True):
+            group.add_member(user)
+
+        assert permissions(user, document) == {"read"}
+
+        with django_capture_on_commit_callbacks(execute=True):
+            group.remove_member(user)
+
+        assert permissions(user, document) == set()
+
+    def test_ancestor_acl_change_invalidates(
+        self, user, locmem_cache, django_assert_num_queries, django_capture_on_commit_callbacks,
+    ):
+        group = GroupFactory()
+        group.add_member(user)
+        folder = FolderFactory(group=group)
+        document = DocumentFactory(author=folder.author, parent=folder, group=group)
+        assert self.cached_permissions(user, document, django_assert_num_queries) == {"read", "write"}
+
+        with django_capture_on_commit_callbacks(execute=True):
+            folder.set_permissions(READ_ONLY)
+            folder.save()
+            folder.cascade_permission()
+
+        document.refresh_from_db()
+        assert permissions(user, document) == {"read"}
+
+    def test_change_is_seen_once_committed(
+        self, user, locmem_cache, django_assert_num_queries, django_capture_on_commit_callbacks,
+    ):
+        folder = FolderFactory()
+        document = DocumentFactory(author=folder.author, parent=folder)
+        assert self.cached_permissions(user, document, django_assert_num_queries) == set()
+
+        with django_capture_on_commit_callbacks(execute=True):
+            folder.add_person(user, permissions=READ_ONLY)
+            assert permissions(user, document) == set()
+
+        assert permissions(user, document) == {"read"}
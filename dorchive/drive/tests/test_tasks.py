@@ -0,0 +1,133 @@
+import pytest
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+
+from dorchive.drive import tasks
+from dorchive.drive.models import Blob
+from dorchive.drive.models import BlobReclaim
+from dorchive.drive.models import File
+from dorchive.drive.models import UserStorage
+from dorchive.drive.progress import trash_progress
+from dorchive.drive.tasks import empty_trash
+from dorchive.drive.tasks import reclaim_blobs
+from dorchive.drive.tasks import reconcile_usage
+from dorchive.drive.tests.factories import DocumentFactory
+from dorchive.drive.tests.factories import FolderFactory
+from dorchive.users.tests.factories import UserFactory
+
+pytestmark = pytest.mark.django_db
+
+
+def test_empty_trash_purges_subtree_and_credits_usage(user):
+    folder = FolderFactory(author=user)
+    DocumentFactory(author=user, parent=folder, file__data=b"12345")
+    kept = DocumentFactory(author=user, file__data=b"123")
+    UserStorage.objects.filter(user=user).update(bytes_used=8)
+    folder.delete()
+
+    assert empty_trash(user.pk) == 2
+
+    assert list(File.all_objects.filter(author=user)) == [kept]
+    user.storage.refresh_from_db()
+    assert user.storage.bytes_used == 3
+
+
+def test_empty_trash_purges_files_trashed_before_their_folder(user):
+    folder = FolderFactory(author=user)
+    subfolder = FolderFactory(author=user, parent=folder)
+    DocumentFactory(author=user, parent=subfolder)
+    DocumentFactory(author=user, parent=folder).delete(user=UserFactory())
+    subfolder.delete(user=user)
+    folder.delete(user=user)
+
+    assert empty_trash(user.pk) == 4
+
+    assert not File.all_objects.exists()
+
+
+def test_empty_trash_leaves_other_trash_alone(user):
+    DocumentFactory(author=user).delete()
+    other = DocumentFactory()
+    other.delete()
+
+    assert empty_trash(user.pk) == 1
+
+    assert list(File.all_objects.all()) == [other]
+
+
+def test_empty_trash_releases_lock(user, locmem_cache):
+    DocumentFactory(author=user).delete()
+    assert trash_progress.start(user.pk)
+
+    empty_trash(user.pk)
+
+    assert not trash_progress.is_running(user.pk)
+    assert trash_progress.get(user.pk)["state"] == trash_progress.DONE
+    assert trash_progress.start(user.pk)
+
+
+def test_reconcile_usage_counts_authored_files(user):
+    DocumentFactory(author=user, file__data=b"12345")
+    DocumentFactory(author=user, file__data=b"123").delete()
+    other = UserFactory()
+    UserStorage.objects.filter(user=user).update(bytes_used=100)
+    UserStorage.objects.filter(user=other).update(bytes_used=100)
+
+    assert reconcile_usage() == 2
+
+    user.storage.refresh_from_db()
+    other.storage.refresh_from_db()
+    assert user.storage.bytes_used == 8
+    assert other.storage.bytes_used == 0
+
+
+class TestReclaimBlobs:
+    def test_deletes_unreferenced_content(self, user):
+        document = DocumentFactory(author=user, file__data=b"content")
+        name = document.file.name
+        document.permanent_delete()
+
+        assert reclaim_blobs() == 1
+
+        assert not default_storage.exists(name)
+        assert not Blob.objects.exists()
+        assert not BlobReclaim.objects.exists()
+
+    def test_keeps_content_referenced_again(self, user):
+        document = DocumentFactory(author=user, file__data=b"content")
+        name = document.file.name
+        document.permanent_delete()
+        DocumentFactory(author=user, file__data=b"content")
+
+        assert reclaim_blobs() == 1
+
+        assert default_storage.exists(name)
+        assert Blob.objects.get().ref_count == 1
+        assert not BlobReclaim.objects.exists()
+
+    def test_empty_trash_reclaims_purged_content(self, user):
+        folder = FolderFactory(author=user)
+        document = DocumentFactory(author=user, parent=folder, file__data=b"content")
+        shared = DocumentFactory(author=user, parent=folder, file__data=b"shared")
+        kept = DocumentFactory(author=user, file__data=b"shared")
+        folder.delete()
+        empty_trash(user.pk)
+
+        assert reclaim_blobs() == 1
+
+        assert not default_storage.exists(document.file.name)
+        assert default_storage.exists(shared.file.name)
+        assert Blob.objects.get().name == kept.file.name
+
+    def test_scheduled_once_per_commit(self, user, monkeypatch, django_capture_on_commit_callbacks):
+        cache.delete(tasks.RECLAIM_PENDING_KEY)
+        calls = []
+        monkeypatch.setattr(reclaim_blobs, "delay", lambda *args: calls.append(args))
+        documents = [DocumentFactory(author=user, file__data=bytes([n])) for n in range(3)]
+
+        with django_capture_on_commit_callbacks(execute=True):
+            for document in documents:
+                document.permanent_delete()
+
+        assert len(calls) == 1
+        assert BlobReclaim.objects.count() == 3
@@ -0,0 +1,334 @@
+import base64
+import json
+from http import HTTPStatus
+
+import pytest
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from dorchive.drive.models import Document
+from dorchive.drive.models import File
+from dorchive.drive.models import GroupFile
+from dorchive.drive.models import UserFile
+from dorchive.drive.models import UserStorage
+from dorchive.drive.progress import trash_progress
+from dorchive.drive.tasks import empty_trash
+from dorchive.drive.tests.factories import DocumentFactory
+from dorchive.drive.tests.factories import FolderFactory
+from dorchive.drive.tests.factories import GroupFactory
+from dorchive.drive.views import FileView
+from dorchive.users.tests.factories import UserFactory
+
+pytestmark = pytest.mark.django_db
+
+
+class TestRestoreFile:
+    def test_restores_own_trash(self, client, user):
+        document = DocumentFactory(author=user)
+        document.delete()
+        client.force_login(user)
+
+        response = client.post(document.get_restore_file_url())
+
+        assert response.status_code == HTTPStatus.FOUND
+        assert response.url == reverse("trash")
+        document.refresh_from_db()
+        assert not document.is_removed
+
+    def test_not_found_for_other_users(self, client, user):
+        document = DocumentFactory(author=user)
+        document.delete()
+        client.force_login(UserFactory())
+
+        response = client.post(document.get_restore_file_url())
+
+        assert response.status_code == HTTPStatus.NOT_FOUND
+        document.refresh_from_db()
+        assert document.is_removed
+
+    def test_not_found_for_files_trashed_with_folder(self, client, user):
+        folder = FolderFactory(author=user)
+        document = DocumentFactory(author=user, parent=folder)
+        folder.delete()
+        client.force_login(user)
+
+        response = client.post(document.get_restore_file_url())
+
+        assert response.status_code == HTTPStatus.NOT_FOUND
+
+    def test_not_found_for_live_files(self, client, user):
+        document = DocumentFactory(author=user)
+        client.force_login(user)
+
+        response = client.post(document.get_restore_file_url())
+
+        assert response.status_code == HTTPStatus.NOT_FOUND
+
+
+class TestRemoveFile:
+    def test_not_found_for_other_users(self, client, user):
+        document = DocumentFactory(author=user)
+        document.delete()
+        client.force_login(UserFactory())
+
+        response = client.post(document.get_remove_file_url())
+
+        assert response.status_code == HTTPStatus.NOT_FOUND
+        document.refresh_from_db()
+        assert document.is_removed
+
+
+class TestFileUpload:
+    def upload(self, client, *contents):
+        files = [SimpleUploadedFile(f"upload-{n}.txt", content) for n, content in enumerate(contents)]
+        return client.post(reverse("file_upload"), {"file": files, "parent": "", "group": ""})
+
+    def test_charges_usage(self, client, user):
+        client.force_login(user)
+
+        response = self.upload(client, b"12345", b"123")
+
+        assert response.status_code == HTTPStatus.FOUND
+        user.storage.refresh_from_db()
+        assert user.storage.bytes_used == 8
+        assert Document.objects.filter(author=user).count() == 2
+
+    def test_over_quota_is_refused(self, client, user):
+        UserStorage.objects.filter(user=user).update(bytes_used=0, bytes_total=6)
+        client.force_login(user)
+
+        response = self.upload(client, b"12345", b"123")
+
+        assert response.status_code == HTTPStatus.OK
+        assert response.context["form"].errors["file"]
+        user.storage.refresh_from_db()
+        assert user.storage.bytes_used == 0
+        assert not Document.objects.filter(author=user).exists()
+
+
+class TestTrashOwnership:
+    @pytest.fixture()
+    def folder(self, client, user):
+        """
+        A folder of user that another user uploaded into, then trashed by user
+        """
+        folder = FolderFactory(author=user)
+        uploader = UserFactory()
+        DocumentFactory(author=uploader, parent=folder).touch(uploader)
+        folder.refresh_from_db()
+        assert folder.modified_by == uploader
+        client.force_login(user)
+        client.post(reverse("file_delete", kwargs={"pk": folder.pk}))
+        folder.refresh_from_db()
+        assert folder.is_removed
+        return folder
+
+    def test_listed_in_trash_of_deleter_only(self, user, folder):
+        assert folder.trashed_by == user
+        assert list(File.get_trash(user)) == [folder]
+        assert not File.get_trash(folder.modified_by).exists()
+
+    def test_restorable_by_deleter_only(self, client, user, folder):
+        client.force_login(folder.modified_by)
+        response = client.post(folder.get_restore_file_url())
+        assert response.status_code == HTTPStatus.NOT_FOUND
+
+        client.force_login(user)
+        response = client.post(folder.get_restore_file_url())
+        assert response.status_code == HTTPStatus.FOUND
+        folder.refresh_from_db()
+        assert not folder.is_removed
+
+    def test_removable_by_deleter_only(self, client, user, folder):
+        client.force_login(folder.modified_by)
+        response = client.post(folder.get_remove_file_url())
+        assert response.status_code == HTTPStatus.NOT_FOUND
+        assert empty_trash(folder.modified_by.pk) == 0
+        assert File.all_objects.filter(pk=folder.pk).exists()
+
+        client.force_login(user)
+        response = client.post(folder.get_remove_file_url())
+        assert response.status_code == HTTPStatus.FOUND
+        assert not File.all_objects.filter(path__startswith=folder.path).exists()
+
+
+class TestUnshare:
+    @pytest.fixture()
+    def folder(self, user):
+        folder = FolderFactory(author=user)
+        document = DocumentFactory(author=user, parent=folder)
+        permissions = {"can_read": True, "can_write": False, "can_delete": False}
+        self.group = GroupFactory()
+        self.person = UserFactory()
+        for file in (folder, document):
+            file.add_group(self.group, permissions=permissions, shared_by=user)
+            file.add_person(self.person, permissions=permissions, shared_by=user)
+        return folder
+
+    def test_owner_revokes_subtree_grants(self, client, user, folder):
+        client.force_login(user)
+
+        response = client.post(reverse("file_remove_group", kwargs={"pk": folder.pk}), {"group": self.group.pk})
+        assert response.status_code == HTTPStatus.FOUND
+        response = client.post(reverse("file_remove_people", kwargs={"pk": folder.pk}), {"people": self.person.pk})
+        assert response.status_code == HTTPStatus.FOUND
+
+        assert not GroupFile.objects.exists()
+        assert not UserFile.objects.exists()
+
+    @pytest.mark.parametrize("url", ["file_remove_group", "file_remove_people"])
+    def test_refused_for_non_owner(self, client, folder, url):
+        client.force_login(UserFactory())
+        data = {"group": self.group.pk, "people": self.person.pk}
+
+        response = client.post(reverse(url, kwargs={"pk": folder.pk}), data)
+
+        assert response.status_code == HTTPStatus.NOT_FOUND
+        assert GroupFile.objects.count() == UserFile.objects.count() == 2
+
+    @pytest.mark.parametrize("url", ["file_remove_group", "file_remove_people"])
+    def test_refused_for_read_only_recipient(self, client, folder, url):
+        client.force_login(self.person)
+        data = {"group": self.group.pk, "people": self.person.pk}
+
+        response = client.post(reverse(url, kwargs={"pk": folder.pk}), data)
+
+        assert response.status_code == HTTPStatus.NOT_FOUND
+        assert GroupFile.objects.count() == UserFile.objects.count() == 2
+
+
+class TestEmptyTrash:
+    def test_concurrent_requests_queue_one_job(
+        self, client, user, locmem_cache, monkeypatch, django_capture_on_commit_callbacks,
+    ):
+        calls = []
+        monkeypatch.setattr(empty_trash, "delay", lambda *args: calls.append(args))
+        client.force_login(user)
+
+        with django_capture_on_commit_callbacks(execute=True):
+            client.post(reverse("empty_trash"))
+            client.post(reverse("empty_trash"))
+
+        assert calls == [(user.pk,)]
+        assert trash_progress.is_running(user.pk)
+
+
+class TestFilePagination:
+    @pytest.fixture()
+    def folder(self, user, file_types, monkeypatch):
+        monkeypatch.setattr(FileView, "paginate_by", 2)
+        folder = FolderFactory(author=user)
+        for name in ("same", "b", "z"):
+            FolderFactory(author=user, parent=folder, name=name)
+        for name in ("a", "same", "c"):
+            DocumentFactory(author=user, parent=folder, name=name)
+        # Names are only unique per author, so ties are broken by id
+        for author in UserFactory.create_batch(3):
+            DocumentFactory(author=author, parent=folder, name="same")
+        return folder
+
+    def walk(self, client, folder):
+        pages = []
+        url = reverse("file_page", kwargs={"pk": folder.pk})
+        while url:
+            response = client.get(url)
+            assert response.status_code == HTTPStatus.OK
+            pages.append(list(response.context["files"]))
+            url = response.context["next_page_url"]
+        return pages
+
+    def test_walks_every_file_once(self, client, user, folder):
+        client.force_login(user)
+
+        pages = self.walk(client, folder)
+
+        expected = sorted(
+            File.objects.filter(parent=folder),
+            key=lambda file: (file.is_file(), file.name, file.pk.hex),
+        )
+        assert [file for page in pages for file in page] == expected
+        assert [len(page) for page in pages] == [2, 2, 2, 2, 1]
+        assert [file.name for file in expected[:3]] == ["b", "same", "z"]
+
+    def test_first_page_of_folder_view(self, client, user, folder):
+        client.force_login(user)
+
+        response = client.get(folder.get_absolute_url())
+
+        assert response.status_code == HTTPStatus.OK
+        assert [file.name for file in response.context["files"]] == ["b", "same"]
+        assert response.context["next_page_url"]
+
+    @pytest.mark.parametrize(
+        "key",
+        [
+            None,
+            [1, "a"],
+            [1, "a", 5],
+            {"rank": 1, "name": "a", "id": "b"},
+            [2 ** 40, "a", "0" * 32],
+            [-1, "a", "0" * 32],
+            [1, "a\x00", "0" * 32],
+        ],
+    )
+    def test_bad_cursor_is_not_found(self, client, user, folder, key):
+        client.force_login(user)
+        cursor = base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+        response = client.get(reverse("file_page", kwargs={"pk": folder.pk}), {"cursor": cursor})
+
+        assert response.status_code == HTTPStatus.NOT_FOUND
+
+    @pytest.mark.parametrize("cursor", ["!!!", "abc", "é"])
+    def test_undecodable_cursor_is_not_found(self, client, user, folder, cursor):
+        client.force_login(user)
+
+        response = client.get(reverse("file_page", kwargs={"pk": folder.pk}), {"cursor": cursor})
+
+        assert response.status_code == HTTPStatus.NOT_FOUND
+
+
+class TestListingQueries:
+    def count_queries(self, client, folder):
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(reverse("file_page", kwargs={"pk": folder.pk}))
+        assert response.status_code == HTTPStatus.OK
+        return len(queries)
+
+    def test_primed_listing_queries_do_not_grow(self, client, user, file_types, locmem_cache):
+        group = GroupFactory()
+        group.add_member(user)
+        owner = UserFactory()
+        folder = FolderFactory(author=owner)
+        folder.add_group(group, permissions={"can_read": True, "can_write": False, "can_delete": False})
+        small = FolderFactory(author=owner, parent=folder)
+        large = FolderFactory(author=owner, parent=folder)
+        DocumentFactory.create_batch(2, author=owner, parent=small)
+        DocumentFactory.create_batch(12, author=owner, parent=large)
+        client.force_login(user)
+
+        assert self.count_queries(client, small) == self.count_queries(client, large)
+
+
+class TestShareSearch:
+    def test_inherited_recipients_are_not_offered(self, client, user):
+        folder = FolderFactory(author=user)
+        document = DocumentFactory(author=user, parent=FolderFactory(author=user, parent=folder))
+        recipient = UserFactory(email="recipient@example.com")
+        other = UserFactory(email="other@example.com")
+        group = GroupFactory(name="Recipients")
+        other_group = GroupFactory(name="Others")
+        permissions = {"can_read": True, "can_write": False, "can_delete": False}
+        folder.add_person(recipient, permissions=permissions)
+        folder.add_group(group, permissions=permissions)
+        client.force_login(user)
+
+        people = client.get(document.get_people_search_url()).json()["results"]
+        groups = client.get(document.get_group_search_url()).json()["results"]
+
+        ids = {result["id"] for result in people}
+        assert str(other.pk) in ids
+        assert str(recipient.pk) not in ids
+        assert [result["id"] for result in groups] == [str(other_group.pk)]
@@ -1,9 +1,12 @@
+import mimetypes
+
 from django.db import transaction
-from django.db.models import F
 from django.forms import ValidationError
-from django.http import HttpResponse
-from django.shortcuts import redirect
+from django.http import Http404, HttpResponse, JsonResponse
+from django.db.models import Q
+from django.shortcuts import get_object_or_404, redirect
 from django.urls import reverse
+from django.utils.http import content_disposition_header
 from django.views import static
 from django.utils.translation import gettext as _
 from django.views.generic import (
@@ -11,7 +14,8 @@ from django.views.generic import (
     DeleteView,
     DetailView,
     TemplateView,
-    UpdateView
+    UpdateView,
+    View,
 )
 from django.views.generic.detail import (
     SingleObjectMixin,
@@ -40,8 +44,13 @@ from .forms import (
     ShareWithPeopleForm,
     GroupMemberForm,
 )
+from .exceptions import QuotaExceededError
 from .hooks import hookset
+from .pagination import KeysetPaginationMixin
 from .models import Document, File, Folder, Group
+from .modifications import modifications
+from .progress import trash_progress
+from .tasks import empty_trash
 from .apps import DriveConfig
 
 APP_NAME = DriveConfig.namespace
@@ -53,10 +62,11 @@ TRASH_URL = "trash"
 class Index(UserMixin, TemplateView):
     template_name =  get_template_name("home.html", APP_NAME)
 
-class MyDrive(UserMixin, TemplateView):
+class MyDrive(UserMixin, KeysetPaginationMixin, TemplateView):
     template_name =  get_template_name("mydrive/index.html", APP_NAME)
     model = File
     context_object_name = "file"
+    page_url_name = "mydrive_page"
 
     def get_files(self, user):
         return File.for_person(user)
@@ -68,21 +78,29 @@ class MyDrive(UserMixin, TemplateView):
         return FileUploadForm()
     
     def get_context_data(self, **kwargs):
-        context = kwargs
         user = self.get_user()
         files = self.get_files(user)
+        context = self.get_page_context(files, **kwargs)
         create_folder_form = self.create_folder_form()
         upload_file_form = self.upload_file_form()
         context.update({ 
             "create_folder_form": create_folder_form,
             "upload_file_form": upload_file_form,
-            "files": files,
         })
         return context
 
-class GroupView(UserMixin, GroupMemberPermission, DetailView):
+class MyDrivePage(MyDrive):
+    template_name =  get_template_name("files/_file_rows.html", APP_NAME)
+
+    def get_context_data(self, **kwargs):
+        user = self.get_user()
+        files = self.get_files(user)
+        return self.get_page_context(files, **kwargs)
+
+class GroupView(UserMixin, GroupMemberPermission, KeysetPaginationMixin, DetailView):
     template_name =  get_template_name("group/index.html", APP_NAME)
     model = Group
+    page_url_name = "group_page"
 
     def folder_create_form(self, group: Group):
         parent = None
@@ -102,20 +120,27 @@ class GroupView(UserMixin, GroupMemberPermission, DetailView):
         return Group.get_files(group)
 
     def get_context_data(self, **kwargs):
-        context = kwargs
         group = self.get_object()
+        files = self.get_files(group)
+        context = self.get_page_context(files, **kwargs)
         create_folder_form = self.folder_create_form(group)
         upload_file_form = self.upload_file_form(group)
-        files = self.get_files(group)
         context.update({ 
             "group": group,
             "create_folder_form": create_folder_form,
             "upload_file_form": upload_file_form,
-            "files": files,
         })
         return context
+
+class GroupPage(GroupView):
+    template_name =  get_template_name("files/_file_rows.html", APP_NAME)
+
+    def get_context_data(self, **kwargs):
+        group = self.get_object()
+        files = self.get_files(group)
+        return self.get_page_context(files, **kwargs)
     
-class GroupMembersView(UserMixin, SingleObjectTemplateResponseMixin,FormMixin,SingleObjectMixin, GroupAdminPermission, ProcessFormView):
+class GroupMembersView(UserMixin, GroupAdminPermission, SingleObjectTemplateResponseMixin,FormMixin,SingleObjectMixin, ProcessFormView):
     template_name =  get_template_name("group/members.html", APP_NAME)
     model = Group
     form_class = GroupMemberForm
@@ -128,7 +153,10 @@ class GroupMembersView(UserMixin, SingleObjectTemplateResponseMixin,FormMixin,Si
         object = self.get_object()
         kwargs = super().get_form_kwargs()
         non_members = object.get_non_members()
-        kwargs.update({"members": non_members})
+        kwargs.update({
+            "members": non_members,
+            "search_url": object.get_member_search_url(),
+        })
         return kwargs
 
     def get_context_data(self, **kwargs):
@@ -172,10 +200,11 @@ class GroupAdmin(UserMixin, GroupAdminPermission, DetailView):
         object.set_admin(member, is_admin)
         return redirect(object.get_members_url())
 
-class FileView(UserMixin, FileReadPermission, DetailView):
+class FileView(UserMixin, FileReadPermission, KeysetPaginationMixin, DetailView):
     template_name =  get_template_name("files/index.html", APP_NAME)
     model = File
     context_object_name = "file"
+    page_url_name = "file_page"
 
     def create_folder_form(self, parent:File, **kwargs):
         return FolderCreateForm(initial={
@@ -194,7 +223,7 @@ class FileView(UserMixin, FileReadPermission, DetailView):
     
     def organize_file_form(self, file:File, **kwargs):
         group = file.group
-        folders = Group.get_folders(group)
+        folders = Group.get_folders(group).exclude(path__startswith=file.path)
         kwargs.update({"folders" : folders})
         return FileOrganizeForm(instance=file, **kwargs)
     
@@ -203,11 +232,11 @@ class FileView(UserMixin, FileReadPermission, DetailView):
     
     def share_group_form(self, file: File, **kwargs):
         non_shared_groups = file.get_non_shared_groups()
-        return ShareWithGroupForm(groups = non_shared_groups)
+        return ShareWithGroupForm(groups = non_shared_groups, search_url=file.get_group_search_url())
     
     def share_people_form(self, file: File, **kwargs):
         non_shared_people = file.get_non_shared_people()
-        return ShareWithPeopleForm(people = non_shared_people)
+        return ShareWithPeopleForm(people = non_shared_people, search_url=file.get_people_search_url())
 
     def get_shared_groups(self, file: File):
         user = self.get_user()
@@ -221,35 +250,57 @@ class FileView(UserMixin, FileReadPermission, DetailView):
         return File.get_files(file)
 
     def get_context_data(self, **kwargs):
-        context = kwargs
         file = self.get_object()
-        create_folder_form = self.create_folder_form(parent=file)
-        upload_file_form = self.upload_file_form(parent=file)
-        rename_file_form = self.rename_file_form(file=file)
-        organize_file_form = self.organize_file_form(file=file)
-        update_file_form = self.update_file_form(file=file)
-        share_group_form = self.share_group_form(file=file)
-        share_people_form = self.share_people_form(file=file)
-
         files = self.get_files(file=file)
-        shared_groups = self.get_shared_groups(file=file)
-        shared_people = self.get_shared_people(file=file)
+        context = self.get_page_context(files, **kwargs)
         context.update({ 
             "file": file,
-            "files": files,
-            "shared_groups": shared_groups,
-            "shared_people": shared_people,
-            "create_folder_form": create_folder_form,
-            "upload_file_form": upload_file_form,
-            "rename_file_form": rename_file_form,
-            "organize_file_form": organize_file_form,
-            "update_file_form": update_file_form,
-            "share_group_form": share_group_form,
-            "share_people_form": share_people_form
-
         })
         return context
 
+class FileModal(FileView):
+    """
+    Render a single modal of the file page, fetched when the user opens it
+    """
+    modals = {
+        "create_folder": "create_folder_form",
+        "upload_file": "upload_file_form",
+        "rename_file": "rename_file_form",
+        "organize_file": "organize_file_form",
+        "update_file": "update_file_form",
+        "share_with_group": "share_group_form",
+        "share_with_people": "share_people_form",
+    }
+
+    def get(self, request, *args, **kwargs):
+        if kwargs["name"] not in self.modals:
+            raise Http404(_("Unknown modal"))
+        return super().get(request, *args, **kwargs)
+
+    def get_template_names(self):
+        return [get_template_name("modals/_%s.html" % self.kwargs["name"], APP_NAME)]
+
+    def get_context_data(self, **kwargs):
+        file = self.get_object()
+        form_name = self.modals[self.kwargs["name"]]
+        context = {
+            "file": file,
+            form_name: getattr(self, form_name)(file),
+        }
+        if form_name == "share_group_form":
+            context["shared_groups"] = self.get_shared_groups(file=file)
+        elif form_name == "share_people_form":
+            context["shared_people"] = self.get_shared_people(file=file)
+        return context
+
+class FilePage(FileView):
+    template_name =  get_template_name("files/_file_rows.html", APP_NAME)
+
+    def get_context_data(self, **kwargs):
+        file = self.get_object()
+        files = self.get_files(file=file)
+        return self.get_page_context(files, **kwargs)
+
 class TrashView(UserMixin, TemplateView):
     template_name =  get_template_name("trash/index.html", APP_NAME)
 
@@ -261,7 +312,8 @@ class TrashView(UserMixin, TemplateView):
         user = self.get_user()
         files = self.get_files(user)
         context.update({ 
-            "files": files
+            "files": files,
+            "trash_progress": trash_progress.get(user.pk),
         })
         return context
     
@@ -275,28 +327,34 @@ class RecentView(UserMixin, TemplateView):
         context = kwargs
         user = self.get_user()
         files = self.get_files(user)
+        user.get_permission_resolver().prime(files)
         context.update({ 
             "files": files
         })
         return context
 
-class SharedView(UserMixin, TemplateView):
+class SharedView(UserMixin, KeysetPaginationMixin, TemplateView):
     template_name =  get_template_name("shared/index.html", APP_NAME)
+    page_url_name = "shared_page"
 
     def get_files(self, user):
         return File.get_shared(user)
     
     def get_context_data(self, **kwargs):
-        context = kwargs
         user = self.get_user()
         files = self.get_files(user)
-        context.update({ 
-            "files": files
-        })
-        return context
+        return self.get_page_context(files, **kwargs)
+
+class SharedPage(SharedView):
+    template_name =  get_template_name("shared/_file_rows.html", APP_NAME)
 
 class SharedFile(FileView):
     template_name =  get_template_name("shared/detail.html", APP_NAME)
+    page_url_name = "shared_file_page"
+
+class SharedFilePage(FilePage):
+    template_name =  get_template_name("shared/_file_rows.html", APP_NAME)
+    page_url_name = "shared_file_page"
 
 class FolderCreate(UserMixin, FileWritePermission, FormView):
     template_name =  get_template_name("files/create_folder.html", APP_NAME)
@@ -319,10 +377,8 @@ class FolderCreate(UserMixin, FileWritePermission, FormView):
 
     def create(self, **kwargs):
         user = self.get_user()
-        folder = self.model.objects.create(**kwargs)
+        folder = self.model(**kwargs)
         folder.touch(user)
-        folder.cascade_permission()
-        folder.cascade_share()
         return folder
     
     def validate(self, **kwargs):
@@ -356,6 +412,8 @@ class FileUpdate(UserMixin, FileReadPermission, FileWritePermission, UpdateView)
 
     def form_valid(self, form):
         super().form_valid(form)
+        if set(form.changed_data) & set(self.object.get_permissions()):
+            self.object.cascade_permission()
         object = self.get_object()
         hookset.file_updated_message(self.request, object)
         return redirect(object.get_absolute_url())
@@ -372,9 +430,8 @@ class FileUpload(UserMixin, FileWritePermission, CreateView):
     
     def create(self, **kwargs):
         user = self.get_user()
-        document = self.model.objects.create(**kwargs)
+        document = self.model(**kwargs)
         document.touch(user)
-        document.cascade_share()
         return document
 
     def get_data(self, file, parent, group):
@@ -396,19 +453,29 @@ class FileUpload(UserMixin, FileWritePermission, CreateView):
             return self.object.get_absolute_url()
 
     def form_valid(self, form):
-        with transaction.atomic():
-            files = form.cleaned_data["file"]
-            parent = form.cleaned_data["parent"]
-            group = form.cleaned_data["group"]
-            author = self.request.user
-
-            for file in files:
-                name = file.name
-                if Document.already_exists(name, parent, author):
-                    raise ValidationError(hookset.file_exists_message(name, parent))
-                kwargs = self.get_data(file, parent, group)
-                self.object = self.create(**kwargs)
-            return redirect(self.get_success_url())
+        try:
+            with transaction.atomic(), modifications.coalesce():
+                return self.upload(form)
+        except QuotaExceededError as error:
+            form.add_error("file", str(error))
+            return self.form_invalid(form)
+
+    def upload(self, form):
+        files = form.cleaned_data["file"]
+        parent = form.cleaned_data["parent"]
+        group = form.cleaned_data["group"]
+        author = self.request.user
+
+        # Reserved before any blob is written and released by the rollback
+        # if the upload fails
+        author.storage.reserve_usage(sum(file.size for file in files))
+        for file in files:
+            name = file.name
+            if Document.already_exists(name, parent, author):
+                raise ValidationError(hookset.file_exists_message(name, parent))
+            kwargs = self.get_data(file, parent, group)
+            self.object = self.create(**kwargs)
+        return redirect(self.get_success_url())
 
 class FileDownload(UserMixin, FileReadPermission, DetailView):
     model = File
@@ -418,9 +485,14 @@ class FileDownload(UserMixin, FileReadPermission, DetailView):
         if settings.DEBUG is False:
             response = HttpResponse()
             response["X-Accel-Redirect"] = self.object.file.url
-            del response["content-type"]
         else:
             response = static.serve(request, self.object.file.name,document_root=settings.MEDIA_ROOT)
+        # Blobs are stored under their digest, so the type comes from the
+        # name the file was uploaded with
+        filename = self.object.original_filename or self.object.name
+        content_type, encoding = mimetypes.guess_type(filename)
+        response["Content-Type"] = content_type or "application/octet-stream"
+        response["Content-Disposition"] = content_disposition_header(False, filename)
         return response
 
 class FileRename(UserMixin, FileWritePermission, UpdateView):
@@ -444,7 +516,7 @@ class FileOrganize(UserMixin, FileWritePermission, UpdateView):
     def get_form_kwargs(self):
         kwargs = super().get_form_kwargs()
         group = self.object.group
-        folders = Group.get_folders(group)
+        folders = Group.get_folders(group).exclude(path__startswith=self.object.path)
         kwargs.update({"folders": folders})
         return kwargs
     
@@ -470,11 +542,11 @@ class FileDelete(UserMixin, FileDeletePermission, DeleteView):
         else:
             success_url = reverse(MY_DRIVE_URL)
 
-        object.delete()
+        object.delete(user=self.get_user())
         hookset.file_deleted_message(request, object)
         return redirect(success_url)
 
-class FileShareWithGroup(UserMixin, SingleObjectTemplateResponseMixin,FormMixin,SingleObjectMixin, FileSharePermission, ProcessFormView):
+class FileShareWithGroup(UserMixin, FileSharePermission, SingleObjectTemplateResponseMixin,FormMixin,SingleObjectMixin, ProcessFormView):
     template_name =  get_template_name("files/share_group.html", APP_NAME)
     model = File
     form_class = ShareWithGroupForm
@@ -488,7 +560,10 @@ class FileShareWithGroup(UserMixin, SingleObjectTemplateResponseMixin,FormMixin,
         object = self.get_object()
         kwargs = super().get_form_kwargs()
         non_shared_groups = object.get_non_shared_groups()
-        kwargs.update({"groups": non_shared_groups})
+        kwargs.update({
+            "groups": non_shared_groups,
+            "search_url": object.get_group_search_url(),
+        })
         return kwargs
 
     def get_context_data(self, **kwargs):
@@ -524,7 +599,7 @@ class FileShareWithGroup(UserMixin, SingleObjectTemplateResponseMixin,FormMixin,
         hookset.file_shared_message(self.request, object)
         return redirect(object.get_absolute_url())
 
-class FileShareWithPeople(UserMixin, SingleObjectTemplateResponseMixin,FormMixin,SingleObjectMixin, FileSharePermission, ProcessFormView):
+class FileShareWithPeople(UserMixin, FileSharePermission, SingleObjectTemplateResponseMixin,FormMixin,SingleObjectMixin, ProcessFormView):
     template_name =  get_template_name("files/share_people.html", APP_NAME)
     model = File
     form_class = ShareWithPeopleForm
@@ -538,7 +613,10 @@ class FileShareWithPeople(UserMixin, SingleObjectTemplateResponseMixin,FormMixin
         object = self.get_object()
         kwargs = super().get_form_kwargs()
         non_shared_people = object.get_non_shared_people()
-        kwargs.update({"people": non_shared_people})
+        kwargs.update({
+            "people": non_shared_people,
+            "search_url": object.get_people_search_url(),
+        })
         return kwargs
 
     def get_context_data(self, **kwargs):
@@ -574,24 +652,26 @@ class FileShareWithPeople(UserMixin, SingleObjectTemplateResponseMixin,FormMixin
         hookset.file_shared_message(self.request, object)
         return redirect(object.get_absolute_url())
 
-class FileRemoveGroup(UserMixin, DetailView):
+class FileRemoveGroup(UserMixin, FileSharePermission, DetailView):
     model = File
     
     def post(self, request, *args, **kwargs):
         object = self.get_object()
         groups = []
         groups.append(request.POST.get("group"))
-        object.remove_groups(groups)
+        revoked = object.remove_groups(groups)
+        hookset.file_unshared_message(request, object, revoked)
         return redirect(object.get_absolute_url())
 
-class FileRemovePeople(UserMixin, DetailView):
+class FileRemovePeople(UserMixin, FileSharePermission, DetailView):
     model = File
 
     def post(self, request, *args, **kwargs):
         object = self.get_object()
         people = []
         people.append(request.POST.get("people"))
-        object.remove_people(people)
+        revoked = object.remove_people(people)
+        hookset.file_unshared_message(request, object, revoked)
         return redirect(object.get_absolute_url())
 
 class EmptyTrash(UserMixin, TemplateView):
@@ -602,8 +682,16 @@ class EmptyTrash(UserMixin, TemplateView):
 
     def post(self, request, *args, **kwargs):
         user = self.get_user()
-        File.objects.empty_trash(user)
+        if trash_progress.start(user.pk):
+            transaction.on_commit(lambda: empty_trash.delay(user.pk))
+        hookset.trash_emptying_message(request)
         return redirect(reverse(TRASH_URL))
+
+class TrashProgressView(UserMixin, View):
+
+    def get(self, request, *args, **kwargs):
+        user = self.get_user()
+        return JsonResponse(trash_progress.get(user.pk) or {})
     
 class RestoreTrash(UserMixin, TemplateView):
     template_name =  get_template_name("trash/restore.html", APP_NAME)
@@ -622,7 +710,7 @@ class RemoveFile(UserMixin, DeleteView):
 
     def get_object(self):
         pk = self.kwargs.get(self.pk_url_kwarg)
-        return File.all_objects.get(pk=pk)
+        return get_object_or_404(File.get_trash(self.get_user()), pk=pk)
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -642,7 +730,7 @@ class RestoreFile(UserMixin, DetailView):
 
     def get_object(self):
         pk = self.kwargs.get(self.pk_url_kwarg)
-        return File.all_objects.get(pk=pk)
+        return get_object_or_404(File.get_trash(self.get_user()), pk=pk)
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -654,4 +742,65 @@ class RestoreFile(UserMixin, DetailView):
     def post(self, request, *args, **kwargs):
         object = self.get_object()
         object.restore()
-        return redirect(reverse(TRASH_URL))
\ No newline at end of file
+        return redirect(reverse(TRASH_URL))
+
+class SearchView(SingleObjectMixin, View):
+    """
+    Paginated JSON search, in the format select2 expects, of what can be
+    picked for the object of the URL. candidates names the method of the
+    object listing them.
+    """
+    paginate_by = 20
+    search_param = "q"
+    candidates = None
+    search_fields = ()
+    ordering = ()
+
+    def get_candidates(self):
+        return getattr(self.object, self.candidates)().order_by(*self.ordering)
+
+    def search(self, queryset, term):
+        query = Q()
+        for field in self.search_fields:
+            query |= Q(**{"%s__icontains" % field: term})
+        return queryset.filter(query)
+
+    def get_result(self, object):
+        return {"id": str(object.pk), "text": str(object)}
+
+    def get_page_number(self):
+        try:
+            return max(int(self.request.GET.get("page", 1)), 1)
+        except ValueError:
+            return 1
+
+    def get(self, request, *args, **kwargs):
+        self.object = self.get_object()
+        term = request.GET.get(self.search_param, "").strip()
+        queryset = self.get_candidates()
+        if term:
+            queryset = self.search(queryset, term)
+        offset = (self.get_page_number() - 1) * self.paginate_by
+        objects = list(queryset[offset:offset + self.paginate_by + 1])
+        return JsonResponse({
+            "results": [self.get_result(object) for object in objects[:self.paginate_by]],
+            "pagination": {"more": len(objects) > self.paginate_by},
+        })
+
+class FilePeopleSearch(UserMixin, FileSharePermission, SearchView):
+    model = File
+    candidates = "get_non_shared_people"
+    search_fields = ("email", "name")
+    ordering = ("email",)
+
+class FileGroupSearch(UserMixin, FileSharePermission, SearchView):
+    model = File
+    candidates = "get_non_shared_groups"
+    search_fields = ("name",)
+    ordering = ("name", "pk")
+
+class GroupMemberSearch(UserMixin, GroupAdminPermission, SearchView):
+    model = Group
+    candidates = "get_non_members"
+    search_fields = ("email", "name")
+    ordering = ("email",)
@@ -2,8 +2,10 @@
 from typing import ClassVar
 
 from django.contrib.auth.models import AbstractUser
+from django.contrib.postgres.indexes import GinIndex, OpClass
 from django.db.models import CharField
 from django.db.models import EmailField
+from django.db.models.functions import Upper
 from django.urls import reverse
 from django.utils.translation import gettext_lazy as _
 from dorchive.drive.models import DriveMixin
@@ -30,6 +32,13 @@ class User(DriveMixin, AbstractUser):
 
     objects: ClassVar[UserManager] = UserManager()
 
+    class Meta:
+        indexes = [
+            # Serve case-insensitive substring searches from the people picker
+            GinIndex(OpClass(Upper("email"), name="gin_trgm_ops"), name="user_email_trgm_idx"),
+            GinIndex(OpClass(Upper("name"), name="gin_trgm_ops"), name="user_name_trgm_idx"),
+        ]
+
     def __str__(self) -> str:
         return self.name if self.name else self.email
 